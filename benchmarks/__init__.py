@@ -0,0 +1,4 @@
+"""
+Package: benchmarks
+Load tests of the Inventory REST API, see benchmarks/api.py
+"""
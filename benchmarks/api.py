@@ -0,0 +1,376 @@
+"""
+REST API Benchmark
+
+Seeds items made by the test factory through the bulk endpoint, then sends
+each scenario at several concurrency levels and reports the throughput and
+latency percentiles as JSON, so two runs can be compared:
+
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.api --output bench.json
+    python -m benchmarks.api --baseline bench.json
+
+Without --url the requests go to the app in this process, with the Flask
+test client, against DATABASE_URI. With --url they go to a running server.
+Run it from the root of the repository, where the factory finds its names
+"""
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import itertools
+import threading
+from datetime import datetime, timezone
+import factory.random
+from service.common.pagination import encode_cursor
+from tests.factories import InventoryFactory
+
+SEED_CHUNK_SIZE = 1000
+BASE_PATH = "/api/inventory"
+
+
+######################################################################
+#  C L I E N T S
+######################################################################
+class AppClient:  # pylint: disable=too-few-public-methods
+    """Sends requests to the app of this process with a Flask test client per thread"""
+
+    def __init__(self):
+        # pylint: disable=import-outside-toplevel
+        from service import app
+        from tests.database import create_tables
+        self.app = app
+        create_tables(app)
+        self.target = app.config["SQLALCHEMY_DATABASE_URI"].split(":", 1)[0]
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        """Returns the status code and JSON body of a request"""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:  # pylint: disable=too-few-public-methods
+    """Sends requests to a running server with a requests session per thread"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.target = self.url
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        """Returns the status code and JSON body of a request"""
+        # pylint: disable=import-outside-toplevel, import-error
+        import requests
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.request(method, self.url + path, json=body, timeout=30)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+######################################################################
+#  S C E N A R I O S
+######################################################################
+class Dataset:
+    """The seeded items the scenarios pick their requests from"""
+
+    def __init__(self, items, restock_ids, random_seed):
+        self.items = items
+        self.restock_ids = iter(restock_ids)
+        self.random = random.Random(random_seed)
+        self._lock = threading.Lock()
+
+    def pick(self):
+        """Returns a random seeded item"""
+        with self._lock:
+            return self.random.choice(self.items)
+
+    def next_restock_id(self):
+        """Returns an item below its restock level that was not restocked yet"""
+        with self._lock:
+            return next(self.restock_ids)
+
+
+def make_payload(**overrides):
+    """Returns the body of a new item made by the factory"""
+    payload = InventoryFactory(**overrides).serialize()
+    del payload["id"]
+    return payload
+
+
+def get_item(data):
+    """Read one item"""
+    return "GET", f"{BASE_PATH}/{data.pick()['id']}", None
+
+
+def list_filter(name, value):
+    """Returns a scenario that lists the items matching one filter"""
+    def scenario(data):
+        return "GET", f"{BASE_PATH}?{name}={value(data.pick())}&limit=100", None
+    scenario.__doc__ = f"List the items filtered by {name}"
+    return scenario
+
+
+def create_item(data):  # pylint: disable=unused-argument
+    """Create one item"""
+    return "POST", BASE_PATH, make_payload()
+
+
+def update_item(data):
+    """Replace one item"""
+    item = data.pick()
+    payload = make_payload(name=item["name"])
+    return "PUT", f"{BASE_PATH}/{item['id']}", payload
+
+
+def restock_item(data):
+    """Restock one item below its restock level"""
+    return "PUT", f"{BASE_PATH}/{data.next_restock_id()}/restock", None
+
+
+SCENARIOS = {
+    "get_item": get_item,
+    "list_name": list_filter("name", lambda item: item["name"]),
+    "list_name_prefix": list_filter("name_prefix", lambda item: item["name"][:3]),
+    "list_condition": list_filter("condition", lambda item: item["condition"]),
+    "list_restock": list_filter("restock", lambda _: "true"),
+    "list_quantity": list_filter("quantity", lambda item: item["quantity"]),
+    "list_quantity_range": list_filter(
+        "quantity_min", lambda item: f"{item['quantity']}&quantity_max={item['quantity'] + 500}"
+    ),
+    "create_item": create_item,
+    "update_item": update_item,
+    "restock_item": restock_item,
+}
+
+
+######################################################################
+#  R U N N E R
+######################################################################
+def seed(client, count, restocks):
+    """
+    Creates count items, and restocks more items without any quantity left
+
+    The bulk endpoint returns the ids of the new items, but not necessarily in
+    the order of the items sent, so the items to restock are created by requests
+    of their own and the others are read back instead of paired with their ids
+
+    Returns:
+        (list, list): the seeded items, and the ids of the items to restock
+    """
+    ids = create_items(client, [make_payload() for _ in range(count)])
+    restock_ids = create_items(client, [make_payload(quantity=0) for _ in range(restocks)])
+    return read_items(client, ids), restock_ids
+
+
+def create_items(client, payloads):
+    """Creates items with the bulk endpoint and returns their ids"""
+    ids = []
+    for start in range(0, len(payloads), SEED_CHUNK_SIZE):
+        chunk = payloads[start:start + SEED_CHUNK_SIZE]
+        code, body = client.request("POST", f"{BASE_PATH}/bulk", chunk)
+        if code != 201:
+            raise RuntimeError(f"Seeding failed with {code}: {body}")
+        ids.extend(body["ids"])
+    return ids
+
+
+def read_items(client, ids):
+    """Returns the items with some ids, read from the pages of the list from the lowest id on"""
+    wanted = set(ids)
+    items = []
+    cursor = min(wanted, default=1) - 1
+    while len(items) < len(wanted):
+        code, body = client.request("GET", f"{BASE_PATH}?limit={SEED_CHUNK_SIZE}&cursor={encode_cursor(cursor)}")
+        if code != 200 or not body:
+            raise RuntimeError(f"Reading the seeded items failed with {code}: {body}")
+        items.extend(item for item in body if item["id"] in wanted)
+        cursor = body[-1]["id"]
+    return items
+
+
+def percentile(ordered, fraction):
+    """Returns the nearest rank percentile of a sorted list"""
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def measure(client, scenario, data, concurrency, total):
+    """Sends total requests of a scenario from concurrency threads and returns their statistics"""
+    counter = itertools.count()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def worker():
+        timings, codes = [], {}
+        while next(counter) < total:
+            method, path, body = scenario(data)
+            start = time.perf_counter()
+            try:
+                code, _ = client.request(method, path, body)
+            except Exception as error:  # pylint: disable=broad-except
+                code = type(error).__name__
+            timings.append(time.perf_counter() - start)
+            codes[str(code)] = codes.get(str(code), 0) + 1
+        with lock:
+            latencies.extend(timings)
+            for code, number in codes.items():
+                statuses[code] = statuses.get(code, 0) + number
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    errors = sum(number for code, number in statuses.items() if not code.isdigit() or int(code) >= 500)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": _ms(percentile(latencies, 0.50)),
+            "p90": _ms(percentile(latencies, 0.90)),
+            "p99": _ms(percentile(latencies, 0.99)),
+            "max": _ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def _ms(seconds):
+    """Converts seconds to rounded milliseconds"""
+    return None if seconds is None else round(1000 * seconds, 3)
+
+
+def run(client, options):
+    """Seeds the items, runs every scenario at every concurrency level and returns the report"""
+    names = options.scenarios or list(SCENARIOS)
+    restocks = options.requests * len(options.concurrency) if "restock_item" in names else 0
+    items, restock_ids = seed(client, options.items, restocks + options.warmup)
+    data = Dataset(items, restock_ids, options.seed)
+    results = []
+    for name in names:
+        if options.warmup:
+            measure(client, SCENARIOS[name], data, 1, options.warmup)
+        for concurrency in options.concurrency:
+            result = measure(client, SCENARIOS[name], data, concurrency, options.requests)
+            results.append({"scenario": name, "concurrency": concurrency, **result})
+            _print_row(results[-1])
+    return {
+        "meta": {
+            "started": datetime.now(timezone.utc).isoformat(),
+            "target": client.target,
+            "python": platform.python_version(),
+            "items": options.items,
+            "requests": options.requests,
+            "seed": options.seed,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Compares a report with a baseline report
+
+    Returns:
+        list: a message for every scenario and concurrency that is slower than
+        the baseline by more than the tolerance, a fraction such as 0.2
+    """
+    previous = {(row["scenario"], row["concurrency"]): row for row in baseline["results"]}
+    regressions = []
+    for row in report["results"]:
+        before = previous.get((row["scenario"], row["concurrency"]))
+        if before is None:
+            continue
+        key = f"{row['scenario']} x{row['concurrency']}"
+        if row["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{key}: throughput {before['throughput_rps']} -> {row['throughput_rps']} req/s"
+            )
+        if row["latency_ms"]["p99"] > before["latency_ms"]["p99"] * (1 + tolerance):
+            regressions.append(
+                f"{key}: p99 {before['latency_ms']['p99']} -> {row['latency_ms']['p99']} ms"
+            )
+        if row["errors"] > before["errors"]:
+            regressions.append(f"{key}: errors {before['errors']} -> {row['errors']}")
+    return regressions
+
+
+def _print_row(row):
+    """Prints a result as it completes"""
+    latency = row["latency_ms"]
+    print(
+        f"{row['scenario']:<22} x{row['concurrency']:<4} {row['throughput_rps']:>9} req/s"
+        f"  p50 {latency['p50']:>8} ms  p99 {latency['p99']:>8} ms  errors {row['errors']}",
+        file=sys.stderr,
+    )
+
+
+def parse_args(argv=None):
+    """Returns the command line options"""
+    parser = argparse.ArgumentParser(description="Benchmark the Inventory REST API")
+    parser.add_argument("--url", help="base URL of a running server, the app of this process without it")
+    parser.add_argument("--items", type=int, default=1000, help="items seeded before the run")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="requests per scenario and concurrency level")
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")],
+                        default=[1, 4, 16], help="comma separated numbers of concurrent clients")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","),
+                        help=f"comma separated scenarios among {', '.join(SCENARIOS)}")
+    parser.add_argument("--warmup", type=int, default=20, help="requests sent before each scenario")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random choices")
+    parser.add_argument("--output", help="file for the JSON report, standard output without it")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown allowed against the baseline, as a fraction")
+    options = parser.parse_args(argv)
+    unknown = set(options.scenarios or ()) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return options
+
+
+def write_report(report, path=None):
+    """Writes a JSON report to path, or to the standard output without one"""
+    if path:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+def main(argv=None):
+    """Runs the benchmark and returns the exit code, 1 when it regressed against the baseline"""
+    options = parse_args(argv)
+    factory.random.reseed_random(options.seed)
+    client = HttpClient(options.url) if options.url else AppClient()
+    report = run(client, options)
+    write_report(report, options.output)
+    if options.baseline:
+        with open(options.baseline, encoding="utf-8") as file:
+            regressions = compare(report, json.load(file), options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
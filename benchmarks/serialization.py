@@ -0,0 +1,154 @@
+"""
+Serialization Micro-benchmark
+
+Times the per-item cost of turning request bodies into Inventory items and
+Inventory items or rows into response bodies, for lists of several sizes:
+
+    DATABASE_URI=sqlite:// python -m benchmarks.serialization --output serialization.json
+
+The list cases read the items from an in-memory SQLite database, so they
+include the cost of building Inventory items or plain rows. The report
+compares the paths the routes used before and after the marshal step was
+dropped. Run it from the root of the repository, where the factory finds its names
+"""
+import sys
+import time
+import argparse
+import platform
+import itertools
+from datetime import datetime, timezone
+import factory.random
+from flask_restx import marshal
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+from service.models import Inventory
+from service.routes import inventory_model
+from benchmarks.api import write_report
+from tests.factories import InventoryFactory
+
+TEMPLATES = 1000
+WORK_PER_SIZE = 50000
+
+# the route paths each case stands for, timed before and after the change
+COMPARISONS = (
+    ("item response", "serialize_marshal", "serialize"),
+    ("list response", "list_items_marshal", "list_rows"),
+)
+
+
+def make_payloads(size):
+    """Returns size request bodies made by the factory"""
+    templates = []
+    for _ in range(min(size, TEMPLATES)):
+        payload = InventoryFactory().serialize()
+        del payload["id"]
+        templates.append(payload)
+    return list(itertools.islice(itertools.cycle(templates), size))
+
+
+def make_cases(size):
+    """Returns the cases timed for lists of size items, by name"""
+    payloads = make_payloads(size)
+    items = [Inventory().deserialize(payload) for payload in payloads]
+    for number, item in enumerate(items, 1):
+        item.id = number
+    engine = create_engine("sqlite://")
+    Inventory.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Inventory), [dict(item.serialize(), condition=item.condition)
+                                               for item in items])
+    with engine.connect() as connection:
+        rows = connection.execute(select(*Inventory.columns())).all()
+    serialize = Inventory.row_serializer(Inventory.FIELDS)
+
+    def list_items_marshal():
+        with Session(engine) as session:
+            found = session.scalars(select(Inventory).order_by(Inventory.id)).all()
+            return marshal([item.serialize() for item in found], inventory_model)
+
+    def list_rows():
+        with engine.connect() as connection:
+            found = connection.execute(select(*Inventory.columns()).order_by(Inventory.id)).all()
+            return list(map(serialize, found))
+
+    return {
+        "deserialize": lambda: [Inventory().deserialize(payload) for payload in payloads],
+        "serialize": lambda: [item.serialize() for item in items],
+        "serialize_marshal": lambda: [marshal(item.serialize(), inventory_model) for item in items],
+        "serialize_row": lambda: [Inventory.serialize_row(row, Inventory.FIELDS) for row in rows],
+        "row_serializer": lambda: list(map(serialize, rows)),
+        "list_items_marshal": list_items_marshal,
+        "list_rows": list_rows,
+    }
+
+
+def best_time(function, repeat):
+    """Returns the shortest of repeat runs of function, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes, repeat=None):
+    """Times every case for every size and returns the report"""
+    results = []
+    for size in sizes:
+        times = repeat or max(3, WORK_PER_SIZE // size)
+        for name, function in make_cases(size).items():
+            seconds = best_time(function, times)
+            results.append({
+                "case": name,
+                "size": size,
+                "repeat": times,
+                "seconds": round(seconds, 6),
+                "us_per_item": round(1e6 * seconds / size, 3),
+            })
+            print(f"{name:<20} {size:>7} items {results[-1]['us_per_item']:>10} us/item", file=sys.stderr)
+    per_item = {(row["case"], row["size"]): row["us_per_item"] for row in results}
+    comparisons = [
+        {
+            "path": path,
+            "size": size,
+            "before": before,
+            "after": after,
+            "before_us_per_item": per_item[before, size],
+            "after_us_per_item": per_item[after, size],
+            "speedup": round(per_item[before, size] / per_item[after, size], 2),
+        }
+        for path, before, after in COMPARISONS
+        for size in sizes
+    ]
+    for row in comparisons:
+        print(f"{row['path']:<14} {row['size']:>7} items {row['before_us_per_item']:>10} -> "
+              f"{row['after_us_per_item']:>10} us/item  x{row['speedup']}", file=sys.stderr)
+    return {
+        "meta": {
+            "started": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sizes": sizes,
+        },
+        "results": results,
+        "comparisons": comparisons,
+    }
+
+
+def main(argv=None):
+    """Runs the micro-benchmark and writes its report"""
+    parser = argparse.ArgumentParser(description="Time the serialization of Inventory items")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=[10, 1000, 100000], help="comma separated numbers of items")
+    parser.add_argument("--repeat", type=int, help="runs of each case, the best one is kept")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the factory")
+    parser.add_argument("--output", help="file for the JSON report, standard output without it")
+    options = parser.parse_args(argv)
+    factory.random.reseed_random(options.seed)
+    report = run(options.sizes, options.repeat)
+    write_report(report, options.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
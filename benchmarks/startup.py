@@ -0,0 +1,117 @@
+"""
+Cold Start Benchmark
+
+Starts fresh Python processes that build the app and answer their first
+readiness check, the work a new pod or gunicorn worker does before it
+serves traffic, and reports how long each phase took:
+
+    DATABASE_URI=sqlite:////tmp/startup.db python -m benchmarks.startup --output startup.json
+
+The phases are importing the service package, building the app with
+create_app(), and the GET /health/ready requests until the first one
+that passes, which opens the first database connection. The schema phase times db.create_all() against the
+tables already made, the DDL round trips every boot paid before the tables
+were left to flask db-migrate
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+PHASES = ("import", "create_app", "first_request", "ready", "schema")
+READY_TIMEOUT = 30.0
+READY_POLL_INTERVAL = 0.005
+
+
+def boot():
+    """Builds the app in this process and prints the seconds of its phases as JSON"""
+    # pylint: disable=import-outside-toplevel
+    timings = {}
+    start = time.perf_counter()
+    import service
+    timings["import"] = time.perf_counter() - start
+    start = time.perf_counter()
+    app = service.app
+    timings["create_app"] = time.perf_counter() - start
+    start = time.perf_counter()
+    client = app.test_client()
+    # like the readiness probe of a pod, ask until the checks of the new worker pass
+    response = client.get("/health/ready")
+    while response.status_code != 200:
+        if time.perf_counter() - start > READY_TIMEOUT:
+            raise RuntimeError(f"The app is not ready: {response.get_json()}")
+        time.sleep(READY_POLL_INTERVAL)
+        response = client.get("/health/ready")
+    timings["first_request"] = time.perf_counter() - start
+    print(json.dumps(timings), flush=True)
+    start = time.perf_counter()
+    with app.app_context():
+        service.models.db.create_all()
+    timings["schema"] = time.perf_counter() - start
+    print(json.dumps(timings), flush=True)
+
+
+def start_once():
+    """Starts a process that boots the app and returns the seconds of its phases"""
+    start = time.perf_counter()
+    with subprocess.Popen([sys.executable, "-m", "benchmarks.startup", "--boot"],
+                          stdout=subprocess.PIPE, text=True) as process:
+        process.stdout.readline()
+        # from the fork to the first answered readiness check, interpreter start included
+        ready = time.perf_counter() - start
+        line = process.stdout.readline()
+        if process.wait() != 0 or not line:
+            raise RuntimeError(f"The app did not start, exit code {process.returncode}")
+    timings = json.loads(line)
+    timings["ready"] = ready
+    return timings
+
+
+def summarize(runs):
+    """Returns the min, median and max milliseconds of every phase of the runs"""
+    return {
+        phase: {
+            "min_ms": round(1000 * min(run[phase] for run in runs), 3),
+            "median_ms": round(1000 * statistics.median(run[phase] for run in runs), 3),
+            "max_ms": round(1000 * max(run[phase] for run in runs), 3),
+        }
+        for phase in PHASES if all(phase in run for run in runs)
+    }
+
+
+def main(argv=None):
+    """Runs the cold start benchmark and writes its report"""
+    parser = argparse.ArgumentParser(description="Time the cold start of the Inventory service")
+    parser.add_argument("--runs", type=int, default=10, help="processes started one after the other")
+    parser.add_argument("--output", help="file for the JSON report, standard output without it")
+    parser.add_argument("--boot", action="store_true", help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+    if options.boot:
+        boot()
+        return 0
+    # imported here since it imports the service, which the boot process must time
+    from benchmarks.api import write_report  # pylint: disable=import-outside-toplevel
+    # the first start makes the tables, so that every measured one finds them
+    start_once()
+    runs = [start_once() for _ in range(options.runs)]
+    phases = summarize(runs)
+    for phase, row in phases.items():
+        print(f"{phase:<14} median {row['median_ms']:>9} ms  min {row['min_ms']:>9} ms"
+              f"  max {row['max_ms']:>9} ms", file=sys.stderr)
+    write_report({
+        "meta": {
+            "started": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "runs": options.runs,
+        },
+        "phases": phases,
+    }, options.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
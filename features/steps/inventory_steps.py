@@ -14,21 +14,25 @@ from compare import expect
 @given('the following inventory items')
 def step_impl(context):
     """ Delete all items and load new ones """
-    # List all of the items and delete them one by one
+    # List all of the items and delete them in a single request
     rest_endpoint = f"{context.BASE_URL}/api/inventory"
     context.resp = requests.get(rest_endpoint)
     expect(context.resp.status_code).to_equal(200)
-    for inventory in context.resp.json():
-        context.resp = requests.delete(f"{rest_endpoint}/{inventory['id']}")
-        expect(context.resp.status_code).to_equal(204)
+    ids = [str(inventory['id']) for inventory in context.resp.json()]
+    if ids:
+        context.resp = requests.delete(f"{rest_endpoint}/bulk", params={"ids": ",".join(ids)})
+        expect(context.resp.status_code).to_equal(200)
 
-    # load the database with new items
-    for row in context.table:
-        payload = {
+    # load the database with new items in a single request
+    payload = [
+        {
             "name": row['name'],
             "condition": row['condition'],
             "quantity": int(row['quantity']),
             "restock_level": int(row['restock_level'])
         }
-        context.resp = requests.post(rest_endpoint, json=payload)
-        expect(context.resp.status_code).to_equal(201)
+        for row in context.table
+    ]
+    context.resp = requests.post(f"{rest_endpoint}/bulk", json=payload)
+    expect(context.resp.status_code).to_equal(201)
+    expect(context.resp.json()["errors"]).to_equal([])
@@ -0,0 +1,34 @@
+"""
+Gunicorn Settings
+
+SERVER_MODE selects how the workers serve the Inventory REST API: sync runs
+the Flask app in threaded (gthread) workers, each serving GUNICORN_THREADS
+requests at once with a session per request, async runs the ASGI app of
+service.asgi in uvicorn workers that each keep many requests in flight
+
+With --preload the master builds the app once and the workers are forked
+with it, so they start faster; post_fork then gives each worker its own
+database connections and log thread
+"""
+import os
+
+SERVER_MODE = os.getenv("SERVER_MODE", "sync")
+
+if SERVER_MODE == "async":
+    wsgi_app = "service.asgi:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+elif SERVER_MODE == "sync":
+    wsgi_app = "service:app"
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "4"))
+else:
+    raise ValueError(f"Unknown SERVER_MODE: {SERVER_MODE}")
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Resets the state a worker inherits from the master that preloaded the Flask app"""
+    # the ASGI app opens its engine in each worker, after the fork
+    if server.cfg.preload_app and SERVER_MODE == "sync":
+        # pylint: disable=import-outside-toplevel
+        from service import app, reset_after_fork
+        reset_after_fork(app)
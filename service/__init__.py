@@ -3,26 +3,31 @@ Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
+
+The app is built by create_app(). service:app is only built the first time
+it is used, so importing the package (from service.asgi, or to run a CLI
+command) does not configure a Flask app. Building the app connects to
+nothing: the database is first reached by a request, and its tables are
+made by "flask db-migrate" instead of at every boot
 """
-# pylint: disable= import-error
+# pylint: disable= import-error, redefined-outer-name
 import sys
+import time
 from flask import Flask
 from flask_restx import Api
 from service import config
 from service.common import log_handlers
+from service.common.metrics import registry
+from service.common.health import probe
+from service.common.profiling import profiler
 
-# Create Flask application
-app = Flask(__name__)
-app.config.from_object(config)
-
-# Disable ERROR_404_HELP will prevent unwanted return msg generated by flask_restx
-app.config['ERROR_404_HELP'] = False
+# the app of service:app, built by __getattr__ below when it is first used
+app: Flask
 
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
-api = Api(app,
-          version='1.0.0',
+api = Api(version='1.0.0',
           title='NYU-DevOps Inventory REST API Service',
           description='This is the Inventory server.',
           default='inventory',
@@ -31,24 +36,75 @@ api = Api(app,
           prefix='/api'
           )
 
-# Dependencies require we import the routes AFTER the Flask app is created
+# Dependencies require we import the routes AFTER the Api is created
 # pylint: disable=wrong-import-position, wrong-import-order
 from service import routes, models  # noqa: E402, E261
 # pylint: disable= wrong-import-position
 from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
 
-app.logger.info(70 * "*")
-app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+def create_app(settings=None):
+    """
+    Creates and configures the Flask app
+
+    Args:
+        settings (dict): values that replace the ones of service.config
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.config.from_object(config)
+    # Disable ERROR_404_HELP will prevent unwanted return msg generated by flask_restx
+    app.config['ERROR_404_HELP'] = False
+    app.config.update(settings or {})
+
+    api.init_app(app)
+    app.register_blueprint(routes.blueprint)
+    cli_commands.init_app(app)
+
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
+
+    # Record the metrics of every request, and profile their SQL when asked to
+    registry.init_app(app)
+    profiler.init_app(app)
+
+    app.logger.info(70 * "*")
+    app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
+
+    try:
+        models.init_db(app)  # set up SQLAlchemy, the tables are made by flask db-migrate
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+
+    # Probe the database for the readiness checks
+    probe.init_app(app, models.db)
+
+    startup = time.perf_counter() - started
+    registry.function("app_startup_seconds", "gauge", "Seconds taken to build the app",
+                      lambda: startup)
+    app.logger.info("Service initialized in %.1f ms!", 1000 * startup)
+    return app
+
+
+def reset_after_fork(app):
+    """
+    Drops what a forked gunicorn worker inherits from the master that
+    preloaded the app: the pooled primary and replica connections, which the two
+    processes must not share, and the log queue, whose thread fork does not copy
+    """
+    with app.app_context():
+        for engine in [*models.db.engines.values(), *models.replicas.engines.values()]:
+            # leave the connections open for the master, only forget them here
+            engine.dispose(close=False)
+    log_handlers.restart_queue()
 
-try:
-    models.init_db(app)  # make our SQLAlchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service initialized!")
+def __getattr__(name):
+    """Builds service:app the first time it is used"""
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
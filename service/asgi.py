@@ -0,0 +1,409 @@
+"""
+ASGI Application
+
+This module serves the item routes of the Inventory REST API as
+coroutines, selected with SERVER_MODE=async. Every request talks to the
+database through an async SQLAlchemy session (asyncpg on PostgreSQL,
+aiosqlite on SQLite), so a worker waiting on the database keeps serving
+its other requests instead of blocking, and one process can keep hundreds
+of requests in flight.
+
+The requests are validated by the same Inventory methods as the Flask
+routes. Writes add their change events to the outbox in their transaction,
+and a relay task of the app removes them and sends them with NOTIFY to the
+item caches and the event subscribers of every worker. The bulk, export,
+change feed, event stream and metrics endpoints are only served by the
+Flask app
+"""
+# pylint: disable=import-error
+import asyncio
+import logging
+import contextlib
+from datetime import datetime
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import parse_etags, quote_etag
+from service import config
+from service.common import status
+from service.common.outbox import CHANNEL, NOTIFY
+from service.common.pagination import encode_cursor, decode_id_cursor
+from service.models import (
+    Inventory, InventoryTombstone, InventoryOutbox, DataValidationError, relay
+)
+
+logger = logging.getLogger("flask.app")
+
+# async drivers of the databases the service runs on
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_uri(uri):
+    """Returns a database URI that uses the async driver of its database"""
+    scheme, separator, rest = uri.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {scheme} databases")
+    return ASYNC_DRIVERS[dialect] + separator + rest
+
+
+def create_app(settings=None):
+    """
+    Creates the ASGI app
+
+    Args:
+        settings (dict): values that replace the ones of service.config
+    """
+    options = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    options.update(settings or {})
+
+    @contextlib.asynccontextmanager
+    async def lifespan(application):
+        state = application.state
+        uri = options.get("ASYNC_DATABASE_URI") or async_database_uri(options["DATABASE_URI"])
+        state.engine = create_async_engine(uri, **options["SQLALCHEMY_ENGINE_OPTIONS"])
+        state.sessions = async_sessionmaker(state.engine, expire_on_commit=False)
+        state.notify = notifies(options.get("OUTBOX_TRANSPORT", "auto"), state.engine.dialect.name)
+        state.wake = asyncio.Event()
+        relaying = None
+        if options.get("OUTBOX_RELAY_THREAD", True):
+            relaying = asyncio.create_task(relay_outbox(
+                state, options.get("OUTBOX_BATCH_SIZE", 100),
+                options.get("OUTBOX_POLL_INTERVAL", 5.0)
+            ))
+        logger.info("Async service running on %s", state.engine.url.drivername)
+        yield
+        if relaying is not None:
+            relaying.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await relaying
+        await state.engine.dispose()
+
+    return Starlette(
+        routes=ROUTES,
+        lifespan=lifespan,
+        exception_handlers={
+            DataValidationError: request_validation_error,
+            HTTPException: http_error,
+        },
+    )
+
+
+def notifies(transport, dialect):
+    """Returns whether the relay sends the events with NOTIFY, as OutboxRelay picks its transport"""
+    if transport == "auto":
+        return dialect == "postgresql"
+    if transport not in ("notify", "memory"):
+        raise ValueError(f"Unknown OUTBOX_TRANSPORT: {transport}")
+    return transport == "notify"
+
+
+######################################################################
+# Outbox relay
+######################################################################
+async def relay_once(state, limit):
+    """
+    Removes up to limit events from the outbox and sends them with NOTIFY in
+    the same transaction, like OutboxRelay.run_once()
+
+    With the memory transport the events are only removed: this process has
+    no item cache and no event subscribers to deliver them to
+
+    Returns:
+        int: the number of events relayed
+    """
+    async with state.sessions() as session, session.begin():
+        rows = (await session.execute(InventoryOutbox.claim_statement(limit))).all()
+        payloads = [payload for _, payload in sorted(rows)]
+        if payloads and state.notify:
+            await session.execute(NOTIFY, {"channel": CHANNEL, "payloads": payloads})
+    return len(payloads)
+
+
+async def relay_outbox(state, batch_size, interval):
+    """Relays events when a write wakes it up, and every interval for those of other workers"""
+    while True:
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(state.wake.wait(), interval)
+        state.wake.clear()
+        try:
+            while await relay_once(state, batch_size) == batch_size:
+                pass
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Outbox relay failed")
+
+
+######################################################################
+# Error Handlers
+######################################################################
+async def request_validation_error(request, error):  # pylint: disable=unused-argument
+    """Handles bad requests with 400_BAD_REQUEST"""
+    message = str(error)
+    logger.warning(message)
+    return JSONResponse({
+        "status_code": status.HTTP_400_BAD_REQUEST,
+        "error": "Bad Request",
+        "message": message,
+    }, status.HTTP_400_BAD_REQUEST)
+
+
+async def http_error(request, error):  # pylint: disable=unused-argument
+    """Returns the message of an aborted request as JSON, like flask-restx"""
+    return JSONResponse({"message": error.detail}, error.status_code,
+                        getattr(error, "headers", None))
+
+
+######################################################################
+# Request helpers
+######################################################################
+async def payload(request):
+    """Returns the JSON body of a request"""
+    try:
+        return await request.json()
+    except ValueError as error:
+        raise DataValidationError(
+            "Invalid Inventory item: body of request contained bad or no data"
+        ) from error
+
+
+def item_id(request):
+    """Returns the validated inventory_id of the path"""
+    return Inventory.validate_id(request.path_params["inventory_id"])
+
+
+def integer_param(request, name):
+    """Returns an integer query string argument, or None without it"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError as error:
+        raise DataValidationError(f"Invalid {name} in query: {value}") from error
+
+
+def item_response(item, code=status.HTTP_200_OK, headers=None):
+    """Returns an item with its ETag"""
+    return JSONResponse(item.serialize(), code, {"ETag": quote_etag(item.etag), **(headers or {})})
+
+
+def not_found(inventory_id):
+    """Aborts a request for an item that does not exist"""
+    return HTTPException(status.HTTP_404_NOT_FOUND,
+                         f"Item with inventory_id: {inventory_id} was not found")
+
+
+async def check_if_match(session, inventory_id, if_match):
+    """
+    Honours the If-Match header of a write, like check_if_match() of the Flask routes
+
+    With If-Match the row stays locked until the commit so the ETag cannot
+    change in between. Aborts with 412 if the item no longer has the given ETag
+
+    Returns:
+        Inventory: the item, or None when it does not exist
+    """
+    item = await session.get(Inventory, inventory_id, with_for_update=bool(if_match))
+    if item is not None and if_match and not parse_etags(if_match).contains(item.etag):
+        raise HTTPException(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"Item with inventory_id: {inventory_id} was changed by another request"
+        )
+    return item
+
+
+async def record_events(session, published):
+    """
+    Adds the change events of a write to the outbox in its transaction, as
+    the Inventory write methods do, so every worker drops its cached copy
+    and publishes them
+
+    Args:
+        published (list): (event type, serialized item) pairs
+    """
+    payloads = [{"payload": relay.payload(event_type, data)} for event_type, data in published]
+    if payloads:
+        await session.execute(insert(InventoryOutbox), payloads)
+
+
+def written(request, response):
+    """Wakes the relay task up once a write has committed its events, and returns the response"""
+    request.app.state.wake.set()
+    return response
+
+
+######################################################################
+# HEALTH
+######################################################################
+async def health(request):  # pylint: disable=unused-argument
+    """Health Status"""
+    return JSONResponse({"status": "OK"})
+
+
+async def readiness(request):
+    """Readiness: the database answers SELECT 1"""
+    try:
+        async with request.app.state.engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+    except Exception as error:  # pylint: disable=broad-except
+        logger.warning("Not ready: the database cannot be reached: %s", error)
+        return JSONResponse({"ready": False, "reasons": ["the database cannot be reached"]},
+                            status.HTTP_503_SERVICE_UNAVAILABLE)
+    return JSONResponse({"ready": True, "reasons": []})
+
+
+######################################################################
+#  PATH: /inventory/{inventory_id}
+######################################################################
+async def get_item(request):
+    """Retrieve a single Inventory item"""
+    inventory_id = item_id(request)
+    logger.info("Request for item with id: %s", inventory_id)
+    async with request.app.state.sessions() as session:
+        item = await session.get(Inventory, inventory_id)
+    if item is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND,
+                            f"Inventory with id '{inventory_id}' was not found.")
+    if parse_etags(request.headers.get("if-none-match")).contains(item.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers={"ETag": quote_etag(item.etag)})
+    return item_response(item)
+
+
+async def update_item(request):
+    """Update an Inventory item, honouring If-Match"""
+    inventory_id = item_id(request)
+    logger.info("Request to update an inventory item with inventory_id:%s", inventory_id)
+    data = await payload(request)
+    async with request.app.state.sessions() as session, session.begin():
+        item = await check_if_match(session, inventory_id, request.headers.get("if-match"))
+        if item is None:
+            raise not_found(inventory_id)
+        item.deserialize(data)
+        item.id = inventory_id
+        item.updated_at = datetime.utcnow()
+        await record_events(session, [("update", item.serialize())])
+    return written(request, item_response(item))
+
+
+async def delete_item(request):
+    """Delete an Inventory item"""
+    inventory_id = item_id(request)
+    logger.info("Request to delete inventory with id: %s", inventory_id)
+    async with request.app.state.sessions() as session, session.begin():
+        statement = delete(Inventory).where(Inventory.id == inventory_id).returning(Inventory.id)
+        if (await session.execute(statement)).first() is not None:
+            session.add(InventoryTombstone(inventory_id=inventory_id))
+            await record_events(session, [("delete", {"id": inventory_id})])
+    return written(request, Response(status_code=status.HTTP_204_NO_CONTENT))
+
+
+######################################################################
+#  PATH: /inventory
+######################################################################
+async def create_item(request):
+    """Create an Inventory item"""
+    logger.info("Request to create an inventory item")
+    item = Inventory().deserialize(await payload(request))
+    async with request.app.state.sessions() as session, session.begin():
+        session.add(item)
+        await session.flush()
+        await record_events(session, [("create", item.serialize())])
+    location = str(request.url_for("get_item", inventory_id=item.id))
+    logger.info("Inventory item named [%s] with ID [%s] created.", item.name, item.id)
+    return written(request, item_response(item, status.HTTP_201_CREATED, {"Location": location}))
+
+
+async def list_items(request):
+    """List the Inventory items matching every one of the given filters"""
+    logger.info("Request to list all inventory items")
+    params = request.query_params
+    filters = {key: params[key] for key in Inventory.FILTERS if params.get(key)}
+    limit = integer_param(request, "limit")
+    cursor = decode_id_cursor(params["cursor"]) if params.get("cursor") else None
+    selected = params["fields"].split(",") if params.get("fields") else None
+    layout = params.get("format") or "rows"
+    if layout not in ("rows", "columnar"):
+        raise DataValidationError("Invalid format in query: " + layout)
+    fields = selected or Inventory.FIELDS
+    statement = Inventory.paginate(
+        select(*Inventory.field_columns(fields)).where(*Inventory.criteria(filters)), cursor, limit
+    )
+    async with request.app.state.sessions() as session:
+        rows = (await session.execute(statement)).all()
+    results = list(map(Inventory.row_serializer(fields), rows))
+    headers = {}
+    if limit and len(rows) == limit:
+        url = request.url.include_query_params(cursor=encode_cursor(rows[-1].id))
+        headers["Link"] = f'<{url}>; rel="next"'
+    if layout == "columnar":
+        results = {field: [result[field] for result in results] for field in fields}
+    return JSONResponse(results, headers=headers)
+
+
+######################################################################
+#  PATH: /inventory/{inventory_id}/restock and /adjust
+######################################################################
+async def restock_item(request):
+    """Restock an Inventory item to one above its restock level"""
+    inventory_id = item_id(request)
+    logger.info("Request to restock an inventory item with inventory_id:%s", inventory_id)
+    if_match = request.headers.get("if-match")
+    async with request.app.state.sessions() as session, session.begin():
+        if if_match:
+            # not found items are left to the UPDATE, to answer 404 as without If-Match
+            await check_if_match(session, inventory_id, if_match)
+        item = (await session.scalars(Inventory.restock_statement(inventory_id))).one_or_none()
+        if item is None:
+            # only look the item up to explain why nothing was restocked
+            if await session.get(Inventory, inventory_id) is None:
+                raise not_found(inventory_id)
+            raise HTTPException(
+                status.HTTP_409_CONFLICT,
+                f"Item with inventory_id: {inventory_id} is already above the restock level"
+            )
+        await record_events(session, [("restock", item.serialize())])
+    return written(request, item_response(item))
+
+
+async def adjust_item(request):
+    """Add a signed delta to the quantity of an Inventory item"""
+    inventory_id = item_id(request)
+    logger.info("Request to adjust an inventory item with inventory_id:%s", inventory_id)
+    delta, floor_at_zero = Inventory.validate_adjustment(await payload(request))
+    statement = Inventory.adjust_statement(inventory_id, delta, floor_at_zero)
+    async with request.app.state.sessions() as session, session.begin():
+        item = (await session.scalars(statement)).one_or_none()
+        if item is None:
+            if await session.get(Inventory, inventory_id) is None:
+                raise not_found(inventory_id)
+            raise HTTPException(
+                status.HTTP_409_CONFLICT,
+                f"Adjusting item with inventory_id: {inventory_id} by {delta} "
+                "would make its quantity negative"
+            )
+        await record_events(session, [("update", item.serialize())])
+    return written(request, JSONResponse(item.serialize()))
+
+
+ROUTES = [
+    Route("/health", health),
+    Route("/health/live", health),
+    Route("/health/ready", readiness),
+    Route("/api/inventory", list_items, methods=["GET"]),
+    Route("/api/inventory", create_item, methods=["POST"]),
+    Route("/api/inventory/{inventory_id}", get_item, methods=["GET"]),
+    Route("/api/inventory/{inventory_id}", update_item, methods=["PUT"]),
+    Route("/api/inventory/{inventory_id}", delete_item, methods=["DELETE"]),
+    Route("/api/inventory/{inventory_id}/restock", restock_item, methods=["PUT"]),
+    Route("/api/inventory/{inventory_id}/adjust", adjust_item, methods=["POST"]),
+]
+
+app = create_app()
@@ -0,0 +1,178 @@
+"""
+Item Cache
+
+This module contains a read-through cache for Inventory items. Entries
+live in an in-process LRU by default, or in any server that speaks the
+Redis protocol when CACHE_BACKEND is "redis"
+"""
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class NullCache:
+    """A cache that never stores anything"""
+
+    def get(self, key):  # pylint: disable=unused-argument
+        """Returns None for every key"""
+        return None
+
+    def set(self, key, value):
+        """Discards the value"""
+
+    def delete(self, key):
+        """Nothing to delete"""
+
+    def clear(self):
+        """Nothing to clear"""
+
+
+class LRUCache:
+    """An in-process least recently used cache whose entries expire after a TTL"""
+
+    def __init__(self, maxsize=4096, ttl=10.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored for key, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= self._clock():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Stores a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Removes the value stored for key"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Removes every value"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """A cache kept in a Redis protocol server, values are stored as JSON"""
+
+    def __init__(self, client, ttl=10.0, prefix="inventory:item:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        """Returns the value stored for key, or None if it is missing"""
+        raw = self.client.get(self.prefix + str(key))
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value):
+        """Stores a value that the server expires after the TTL"""
+        self.client.set(self.prefix + str(key), json.dumps(value), ex=max(1, int(self.ttl)))
+
+    def delete(self, key):
+        """Removes the value stored for key"""
+        self.client.delete(self.prefix + str(key))
+
+    def clear(self):
+        """Removes every value under this cache's prefix"""
+        for name in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(name)
+
+
+class ItemCache:
+    """
+    Read-through cache used by Inventory.find that counts its hits and misses
+
+    Like the SQLAlchemy object it is created first and configured later
+    from the Flask app with init_app()
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else NullCache()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        """Selects the backend named by the CACHE_BACKEND setting"""
+        name = app.config.get("CACHE_BACKEND", "memory")
+        ttl = app.config.get("CACHE_TTL", 10.0)
+        if name == "memory":
+            self.backend = LRUCache(app.config.get("CACHE_MAX_ITEMS", 4096), ttl)
+        elif name == "redis":
+            try:
+                import redis  # pylint: disable=import-outside-toplevel
+            except ImportError as error:
+                raise ValueError("CACHE_BACKEND redis needs the redis package of requirements.txt") \
+                    from error
+            client = redis.Redis.from_url(app.config["CACHE_REDIS_URL"])
+            self.backend = RedisCache(client, ttl)
+        elif name == "none":
+            self.backend = NullCache()
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND: {name}")
+        self.reset_stats()
+
+    def get(self, key):
+        """Returns the cached value for key, or None, and counts the hit or miss"""
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Caches a value"""
+        self.backend.set(key, value)
+
+    def invalidate(self, *keys):
+        """Drops the cached values of keys after they were written"""
+        for key in keys:
+            self.backend.delete(key)
+        with self._lock:
+            self.invalidations += len(keys)
+
+    def clear(self):
+        """Drops every cached value"""
+        self.backend.clear()
+
+    def reset_stats(self):
+        """Sets the counters back to zero"""
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def stats(self):
+        """Returns the counters used for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,8 +1,13 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
-from service.models import db
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from service.models import db, Inventory, InventoryTombstone
 
 
 ######################################################################
@@ -10,7 +15,8 @@ from service.models import db
 # Usage:
 #   flask db-create
 ######################################################################
-@app.cli.command("db-create")
+@click.command("db-create")
+@with_appcontext
 def db_create():
     """
     Recreates a local database. You probably should not use this on
@@ -19,3 +25,52 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to make or bring a database up to date, run before
+# the service starts since the app does not make its tables
+# Usage:
+#   flask db-migrate
+######################################################################
+@click.command("db-migrate")
+@with_appcontext
+def db_migrate():
+    """
+    Creates any missing tables and indexes without dropping data.
+    On PostgreSQL indexes are built CONCURRENTLY so writes are not blocked.
+    """
+    db.create_all()
+    connection = db.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    with connection:
+        indexes = [*Inventory.__table__.indexes, *InventoryTombstone.__table__.indexes]
+        for index in indexes:
+            statement = CreateIndex(index, if_not_exists=True)
+            if connection.dialect.name == "postgresql":
+                sql = str(statement.compile(dialect=connection.dialect))
+                statement = text(sql.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1))
+            current_app.logger.info("Creating index %s", index.name)
+            connection.execute(statement)
+
+
+######################################################################
+# Command to forget old deletions recorded for the change feed
+# Usage:
+#   flask db-prune-tombstones --days 30
+######################################################################
+@click.command("db-prune-tombstones")
+@with_appcontext
+@click.option("--days", default=30, show_default=True, help="Keep tombstones younger than this")
+def db_prune_tombstones(days):
+    """
+    Removes the tombstones of items deleted more than --days ago. Clients
+    that sync less often than that must start over with a full list.
+    """
+    count = InventoryTombstone.prune(datetime.utcnow() - timedelta(days=days))
+    click.echo(f"Removed {count} tombstones")
+
+
+def init_app(app):
+    """Adds the commands to the flask command of the app"""
+    for command in (db_create, db_migrate, db_prune_tombstones):
+        app.cli.add_command(command)
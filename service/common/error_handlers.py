@@ -17,8 +17,9 @@
 """
 Module: error_handlers
 """
+from flask import current_app
 from service.models import DataValidationError
-from service import app, api
+from service import api
 from . import status
 
 ######################################################################
@@ -30,7 +31,7 @@ from . import status
 def request_validation_error(error):
     "Handles bad requests with 400_BAD_REQUEST"""
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return {
         'status_code': status.HTTP_400_BAD_REQUEST,
         'error': 'Bad Request',
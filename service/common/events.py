@@ -0,0 +1,182 @@
+"""
+Change Events
+
+This module contains an in-process broker that fans out the changes made
+to Inventory items to every Server-Sent Events subscriber. Each subscriber
+has a bounded queue; one that falls too far behind is disconnected and can
+resume from the broker's history with the Last-Event-ID header. The number
+of subscribers is capped, as each one holds a thread of the worker.
+
+Event ids start with an epoch that is unique to the broker, so a client
+that reconnects to another worker or after a restart is told to resync
+instead of being replayed unrelated events
+"""
+import json
+import uuid
+import queue
+import threading
+from collections import deque, namedtuple
+
+
+class Event(namedtuple("Event", ["epoch", "id", "type", "data"])):
+    """A change to an Inventory item"""
+
+    __slots__ = ()
+
+    def to_sse(self):
+        """Formats the event as a Server-Sent Events message"""
+        return f"id: {self.epoch}-{self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class TooManySubscribers(Exception):
+    """Raised when the broker already has as many subscribers as it accepts"""
+
+
+class Subscription:
+    """The queue of events waiting to be sent to one subscriber"""
+
+    def __init__(self, maxsize, types=None):
+        self.queue = queue.Queue(maxsize)
+        self.types = frozenset(types) if types else None
+        self.replay = []
+        self.missed = False
+        self.dropped = False
+
+    def wants(self, event):
+        """Returns True if the subscriber asked for this type of event"""
+        return self.types is None or event.type in self.types
+
+    def events(self, keepalive):
+        """
+        Yields the replayed events, then each new event as it is published
+
+        None is yielded after keepalive seconds without an event so the caller
+        can keep the connection open. Once the broker has dropped the subscriber
+        the events already queued are yielded and the generator ends
+        """
+        yield from self.replay
+        while True:
+            try:
+                event = self.queue.get(block=not self.dropped, timeout=keepalive)
+            except queue.Empty:
+                if self.dropped:
+                    return
+                event = None
+            yield event
+
+
+class EventBroker:
+    """
+    Publishes events to every subscriber and keeps the latest ones for replay
+
+    Like the SQLAlchemy object it is created first and configured later
+    from the Flask app with init_app()
+    """
+
+    def __init__(self, history=1000, queue_size=256, max_subscribers=None):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.epoch = uuid.uuid4().hex[:8]
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.refused = 0
+
+    def init_app(self, app):
+        """Sizes the history, the subscriber queues and the number of subscribers from the app settings"""
+        with self._lock:
+            self._history = deque(self._history, maxlen=app.config.get("EVENTS_HISTORY", 1000))
+            self.queue_size = app.config.get("EVENTS_QUEUE_SIZE", 256)
+            self.max_subscribers = app.config.get("EVENTS_MAX_SUBSCRIBERS")
+
+    def publish(self, event_type, data):
+        """
+        Sends an event to every subscriber without blocking
+
+        A subscriber whose queue is full is dropped instead of slowing down
+        the writer that published the event
+
+        Returns:
+            Event: the published event with its id
+        """
+        with self._lock:
+            self._last_id += 1
+            event = Event(self.epoch, self._last_id, event_type, data)
+            self._history.append(event)
+            self.published += 1
+            for subscriber in list(self._subscribers):
+                if not subscriber.wants(event):
+                    continue
+                try:
+                    subscriber.queue.put_nowait(event)
+                except queue.Full:
+                    subscriber.dropped = True
+                    self._subscribers.discard(subscriber)
+                    self.dropped += 1
+        return event
+
+    def subscribe(self, last_event_id=None, types=None):
+        """
+        Registers a new subscriber
+
+        Args:
+            last_event_id (str): the id of the last event the subscriber received
+            types (list): the event types to receive, all of them when empty
+
+        Returns:
+            Subscription: with the events published after last_event_id in replay,
+            or with missed set when they are no longer in the history
+
+        Raises:
+            TooManySubscribers: when there are already max_subscribers subscribers
+        """
+        subscription = Subscription(self.queue_size, types)
+        if last_event_id is not None:
+            last_event_id = self._sequence(last_event_id)
+            subscription.missed = last_event_id is None
+        with self._lock:
+            if self.max_subscribers is not None and len(self._subscribers) >= self.max_subscribers:
+                self.refused += 1
+                raise TooManySubscribers(f"The {self.max_subscribers} event subscribers are connected")
+            if last_event_id is not None:
+                oldest = self._history[0].id if self._history else self._last_id + 1
+                if last_event_id > self._last_id or last_event_id < oldest - 1:
+                    subscription.missed = True
+                else:
+                    subscription.replay = [
+                        event for event in self._history
+                        if event.id > last_event_id and subscription.wants(event)
+                    ]
+            self._subscribers.add(subscription)
+        return subscription
+
+    def _sequence(self, event_id):
+        """Returns the sequence number of an id given by this broker, or None"""
+        epoch, _, sequence = event_id.partition("-")
+        if epoch != self.epoch or not sequence.isdecimal():
+            return None
+        return int(sequence)
+
+    def unsubscribe(self, subscription):
+        """Stops sending events to a subscriber"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def clear(self):
+        """Forgets the history, used by the tests"""
+        with self._lock:
+            self._history.clear()
+
+    def stats(self):
+        """Returns the counters used for monitoring"""
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "last_event_id": f"{self.epoch}-{self._last_id}",
+                "published": self.published,
+                "dropped": self.dropped,
+                "refused": self.refused,
+            }
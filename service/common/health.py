@@ -0,0 +1,174 @@
+"""
+Readiness Probe
+
+This module contains the checks behind GET /health/ready. A background
+thread runs SELECT 1 on a connection kept outside the pool and samples the
+pool every HEALTH_CHECK_INTERVAL seconds, so a probe from the load balancer
+only reads the cached result and adds no load to the database
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+from service.common.pool import metrics
+
+logger = logging.getLogger("flask.app")
+
+
+class HealthProbe:
+    """
+    Caches whether this worker can serve traffic
+
+    The worker is not ready when the last SELECT 1 failed, when the last
+    check is too old, or when the pool stayed saturated for
+    HEALTH_SATURATED_CHECKS checks in a row
+    """
+
+    def __init__(self):
+        self.interval = 5.0
+        self.saturated_checks = 3
+        self._app = None
+        self._db = None
+        self._connection = None
+        self._timeouts = 0
+        self._state = None
+        self._lock = threading.Lock()
+        self._checking = threading.Lock()
+        self._starting = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app, db):
+        """Reads the settings and remembers the database to probe"""
+        self._app = app
+        self._db = db
+        self.interval = app.config.get("HEALTH_CHECK_INTERVAL", 5.0)
+        self.saturated_checks = app.config.get("HEALTH_SATURATED_CHECKS", 3)
+        self._state = None
+
+    def check(self):
+        """Runs the checks once and caches their result, one caller at a time"""
+        with self._checking:
+            self._check()
+
+    def _check(self):
+        """Runs the checks, the caller holds the checking lock"""
+        database = self._ping()
+        pool = metrics.stats()
+        # callers blocked in the pool, or new timeouts, mean it has no free connection
+        saturated = pool["waiting"] > 0 or pool["timeouts"] > self._timeouts
+        self._timeouts = pool["timeouts"]
+        with self._lock:
+            streak = 0
+            if saturated:
+                streak = 1 + (self._state["pool"]["saturated_checks"] if self._state else 0)
+            self._state = {
+                "checked_at": time.monotonic(),
+                "checked": datetime.utcnow().isoformat(),
+                "database": database,
+                "pool": {
+                    "saturated": saturated,
+                    "saturated_checks": streak,
+                    "waiting": pool["waiting"],
+                },
+            }
+
+    def _ping(self):
+        """Times SELECT 1, reconnecting first if the last probe failed"""
+        start = time.perf_counter()
+        try:
+            if self._connection is None:
+                connection = self._db.engine.raw_connection()
+                connection.detach()
+                self._connection = connection
+            cursor = self._connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            self._connection.rollback()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Readiness probe cannot reach the database: %s", error)
+            self._close()
+            return {"ok": False, "error": str(error), "latency_ms": None}
+        return {"ok": True, "error": None, "latency_ms": round((time.perf_counter() - start) * 1000, 3)}
+
+    def _close(self):
+        """Drops the probe connection so the next check reconnects"""
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            self._connection = None
+
+    def status(self):
+        """
+        Returns the cached result and whether the worker is ready
+
+        Without the background thread the checks run here, at most once per
+        interval: while another request runs them the last result is served,
+        and only the requests before the first result wait for it
+        """
+        with self._lock:
+            state = self._state
+        if self._thread is None and self._age(state) >= self.interval \
+                and self._checking.acquire(blocking=state is None):
+            try:
+                with self._lock:
+                    state = self._state
+                # the checks may have just been run by the request that held the lock
+                if self._age(state) >= self.interval:
+                    self._check()
+            finally:
+                self._checking.release()
+            with self._lock:
+                state = self._state
+        age = self._age(state)
+        reasons = []
+        if age > 3 * self.interval:
+            reasons.append("the last check is too old")
+        else:
+            if not state["database"]["ok"]:
+                reasons.append("the database cannot be reached")
+            if state["pool"]["saturated_checks"] >= self.saturated_checks:
+                reasons.append("the connection pool is exhausted")
+        result = {"ready": not reasons, "reasons": reasons}
+        if state is not None:
+            result.update(
+                checked=state["checked"],
+                age_seconds=round(age, 3),
+                database=state["database"],
+                pool=state["pool"],
+            )
+        return result
+
+    @staticmethod
+    def _age(state):
+        """Returns the seconds since a check, infinite before the first one"""
+        return float("inf") if state is None else time.monotonic() - state["checked_at"]
+
+    def start(self):
+        """Starts the background checks once, when the setting allows it"""
+        if self._thread is not None or not self._app.config.get("HEALTH_CHECK_THREAD", True):
+            return
+        with self._starting:
+            if self._thread is not None:
+                return
+            # the first probe of the worker must find a result, not wait for the thread's
+            self.check()
+            self._thread = threading.Thread(target=self._run, name="health-probe", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Checks every interval, after the check made by start(), until the process ends"""
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self._app.app_context():
+                    self.check()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Readiness probe failed")
+
+
+probe = HealthProbe()
@@ -18,21 +18,218 @@
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. Records can be written as text or as JSON lines carrying the
+id of the request that logged them. A queue hands them to a thread that
+formats and writes them, so requests do not wait on the log stream, and
+high volume info messages can be sampled per logger
 """
+import re
+import copy
+import json
+import time
+import uuid
+import queue
+import atexit
 import logging
+import itertools
+import logging.handlers
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+# the listener writing the records queued by this process, and the handler queuing them
+_listener = None
+_handler = None
+# the names of the loggers given a SamplingFilter by the last init_logging()
+_sampled = set()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one line of JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime(DATE_FORMAT, time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if getattr(record, "sample_rate", None) is not None:
+            entry["sample_rate"] = record.sample_rate
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the id of the current request to every record, - outside a request"""
+
+    def filter(self, record):
+        record.request_id = g.get("request_id", "-") if has_request_context() else "-"
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every 1 / rate info and debug records of each message
+
+    Warnings and errors are always kept, and so is the first record of
+    each message. Kept records carry the rate so they can be counted back
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._counts = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if not self.every:
+            return False
+        count = self._counts.get(record.msg)
+        if count is None:
+            count = self._counts.setdefault(record.msg, itertools.count())
+        if next(count) % self.every:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records when the queue is full instead of blocking"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """
+        Makes a record safe to queue, like QueueHandler.prepare(), but keeps the
+        traceback in exc_text instead of appending it to the message, so the
+        formatter of the listener still writes it as the exception of the record
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+def parse_sampling(setting):
+    """Returns the rates of a LOG_SAMPLING setting such as "flask.app=0.1,service=0.5"
+
+    Raises:
+        ValueError: when the setting is not a list of logger=rate pairs
+    """
+    rates = {}
+    for pair in filter(None, (part.strip() for part in (setting or "").split(","))):
+        name, _, rate = pair.partition("=")
+        rates[name.strip()] = float(rate)
+        if not 0 <= rates[name.strip()] <= 1:
+            raise ValueError(f"Sampling rate of {name} is not between 0 and 1")
+    return rates
+
+
+def start_queue(handlers, size):
+    """Returns a handler that queues records for a thread writing them to handlers"""
+    global _listener, _handler  # pylint: disable=global-statement
+    stop_queue()
+    log_queue = queue.Queue(size)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _handler = DroppingQueueHandler(log_queue)
+    return _handler
+
+
+def restart_queue():
+    """
+    Starts the listener again in a forked process, which inherits a copy of
+    the queue but not the thread that writes its records
+    """
+    if _listener is None:
+        return
+    _listener.queue = _handler.queue = queue.Queue(_listener.queue.maxsize)
+    # the inherited thread object refers to a thread of the parent process
+    _listener._thread = None  # pylint: disable=protected-access
+    _listener.start()
+
+
+@atexit.register
+def stop_queue():
+    """Writes the records still queued and stops the listener thread"""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
+    handlers = list(gunicorn_logger.handlers)
     # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s",
-        "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT", "text") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
         handler.setFormatter(formatter)
+    if handlers and app.config.get("LOG_QUEUE", True):
+        handlers = [start_queue(handlers, app.config.get("LOG_QUEUE_SIZE", 10000))]
+    # the request id is read here, in the thread that logs
+    for handler in handlers:
+        handler.addFilter(RequestIdFilter())
+    app.logger.handlers = handlers
+    app.logger.setLevel(gunicorn_logger.level)
+    # the models and common modules log to flask.app
+    if handlers:
+        module_logger = logging.getLogger("flask.app")
+        module_logger.propagate = False
+        module_logger.handlers = handlers
+        module_logger.setLevel(gunicorn_logger.level)
+    set_sampling(parse_sampling(app.config.get("LOG_SAMPLING")))
+    app.before_request(_assign_request_id)
+    app.after_request(_return_request_id)
     app.logger.info("Logging handler established")
+
+
+def set_sampling(rates):
+    """Replaces the SamplingFilters of the last call, so the rates do not compound"""
+    for name in _sampled:
+        logger = logging.getLogger(name)
+        for sampler in [item for item in logger.filters if isinstance(item, SamplingFilter)]:
+            logger.removeFilter(sampler)
+    _sampled.clear()
+    for name, rate in rates.items():
+        logging.getLogger(name).addFilter(SamplingFilter(rate))
+        _sampled.add(name)
+
+
+def _assign_request_id():
+    """Uses the request id sent by the client or the proxy, or makes a new one"""
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    g.request_id = request_id if REQUEST_ID_PATTERN.match(request_id) else uuid.uuid4().hex
+
+
+def _return_request_id(response):
+    """Tells the client the id its request was logged with"""
+    if "request_id" in g:
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
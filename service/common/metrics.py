@@ -0,0 +1,276 @@
+"""
+Request Metrics
+
+This module contains a small metrics registry rendered in the Prometheus
+text format by GET /metrics. It counts the requests, request latencies,
+response sizes and database queries of each flask-restx resource.
+
+Every thread records into its own shard, so recording never waits on a
+lock; shards are only merged when /metrics is scraped. With METRICS_DIR
+set, each gunicorn worker also writes its totals to a file in that
+directory about once a second, and /metrics adds up the files of every
+worker so a scrape that reaches any worker sees the whole service
+"""
+import os
+import glob
+import json
+import time
+import bisect
+import logging
+import threading
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Registry:
+    """Metric families and the per-thread shards that hold their values"""
+
+    def __init__(self):
+        self.families = {}
+        self.functions = {}
+        self.directory = None
+        self.flush_interval = 1.0
+        self._last_flush = 0.0
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, labels=()):
+        """Declares a counter"""
+        self.families[name] = ("counter", description, tuple(labels), None)
+
+    def gauge(self, name, description, labels=()):
+        """Declares a gauge that is moved up and down with inc()"""
+        self.families[name] = ("gauge", description, tuple(labels), None)
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        """Declares a histogram with the given upper bounds"""
+        self.families[name] = ("histogram", description, tuple(labels), tuple(buckets))
+
+    def function(self, name, kind, description, function):
+        """Declares a counter or gauge of this process whose value is read from function() at scrape time"""
+        self.functions[name] = (kind, description, function)
+
+    def _shard(self):
+        """Returns the values recorded by the current thread"""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, labels=(), amount=1):
+        """Adds amount to a counter or gauge"""
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Records a value in a histogram"""
+        buckets = self.families[name][3]
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # one count per bucket, one for +Inf, then the sum of the values
+            counts = shard[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self):
+        """Returns the values of this process, adding up the shards of all threads"""
+        with self._lock:
+            shards = list(self._shards)
+        totals = {}
+        for shard in shards:
+            for key, value in shard.copy().items():
+                _add(totals, key, list(value) if isinstance(value, list) else value)
+        return totals
+
+    def init_app(self, app):
+        """Reads METRICS_DIR and records the metrics of every request of the app"""
+        self.directory = app.config.get("METRICS_DIR") or None
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", 1.0)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(_before_request)
+        app.after_request(_after_request)
+        app.teardown_request(_teardown_request)
+
+    def flush(self, force=False):
+        """Writes the totals of this process to METRICS_DIR at most once per flush interval"""
+        now = time.monotonic()
+        if not self.directory or (not force and now - self._last_flush < self.flush_interval):
+            return
+        self._last_flush = now
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        rows = [[name, list(labels), value] for (name, labels), value in self.collect().items()]
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(rows, file)
+            os.replace(path + ".tmp", path)
+        except OSError as error:
+            logger.warning("Cannot write metrics to %s: %s", path, error)
+
+    def collect_all(self):
+        """Returns the values of every worker sharing METRICS_DIR, or of this process"""
+        totals = self.collect()
+        if not self.directory:
+            return totals
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            pid = int(os.path.basename(path)[len("metrics-"):-len(".json")])
+            if pid == os.getpid():
+                continue
+            alive = _alive(pid)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    rows = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in rows:
+                # a stopped worker keeps its counts but no longer has requests in flight
+                if alive or self.families.get(name, ("counter",))[0] != "gauge":
+                    _add(totals, (name, tuple(labels)), value)
+        return totals
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        totals = self.collect_all()
+        lines = []
+        for name, (kind, description, labelnames, buckets) in self.families.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (family, labels), value in sorted(totals.items()):
+                if family != name:
+                    continue
+                pairs = list(zip(labelnames, labels))
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), value):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+        for name, (kind, description, function) in self.functions.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f'{name}{_labels([("pid", os.getpid())])} {_number(function())}')
+        return "\n".join(lines) + "\n"
+
+
+def _add(totals, key, value):
+    """Adds a counter value or histogram counts into totals"""
+    if key not in totals:
+        totals[key] = value
+    elif isinstance(value, list):
+        totals[key] = [mine + theirs for mine, theirs in zip(totals[key], value)]
+    else:
+        totals[key] += value
+
+
+def _alive(pid):
+    """Returns True if a process with this pid is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _labels(pairs):
+    """Formats label pairs as {name="value",...}"""
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    """Escapes a label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    """Formats a sample value"""
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+registry.counter("http_requests_total", "Requests served", ("resource", "method", "status"))
+registry.histogram("http_request_duration_seconds", "Time to produce a response",
+                   ("resource", "method"))
+registry.histogram("http_response_size_bytes", "Size of the response bodies",
+                   ("resource", "method"), SIZE_BUCKETS)
+registry.gauge("http_requests_in_flight", "Requests being served")
+registry.histogram("db_queries_per_request", "Database queries run by one request",
+                   ("resource", "method"), QUERY_BUCKETS)
+registry.histogram("db_query_duration_seconds", "Time spent in each database query",
+                   ("resource", "method"))
+
+# per thread count of the queries run by the current request
+_queries = threading.local()
+
+
+def _before_request():
+    view = _view_name(request.endpoint) if request.url_rule else "none"
+    g._metrics_labels = (view, request.method)  # pylint: disable=protected-access
+    g._metrics_start = time.perf_counter()  # pylint: disable=protected-access
+    _queries.count = 0
+    _queries.labels = (view, request.method)
+    registry.inc("http_requests_in_flight")
+
+
+def _after_request(response):
+    labels = g.get("_metrics_labels", ("none", request.method))
+    start = g.get("_metrics_start")
+    if start is not None:
+        registry.observe("http_request_duration_seconds", labels, time.perf_counter() - start)
+    registry.inc("http_requests_total", labels + (str(response.status_code),))
+    # the length of a streamed body is unknown, and computing it would read the whole stream
+    size = None if response.is_streamed else response.calculate_content_length()
+    if size is not None:
+        registry.observe("http_response_size_bytes", labels, size)
+    registry.observe("db_queries_per_request", labels, getattr(_queries, "count", 0))
+    registry.flush()
+    return response
+
+
+def _teardown_request(error):  # pylint: disable=unused-argument
+    if g.pop("_metrics_start", None) is not None:
+        registry.inc("http_requests_in_flight", amount=-1)
+    _queries.labels = ("none", "none")
+
+
+def _view_name(endpoint):
+    """Returns the class name of a flask-restx resource, or the endpoint of a plain route"""
+    view = current_app.view_functions.get(endpoint)
+    view_class = getattr(view, "view_class", None)
+    return view_class.__name__ if view_class is not None else endpoint
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument, too-many-arguments
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument, too-many-arguments
+    start = conn.info["metrics_query_start"].pop()
+    labels = getattr(_queries, "labels", ("none", "none"))
+    registry.observe("db_query_duration_seconds", labels, time.perf_counter() - start)
+    _queries.count = getattr(_queries, "count", 0) + 1
@@ -0,0 +1,226 @@
+"""
+Transactional Outbox
+
+The Inventory write methods add their change events to an outbox table in
+the same transaction as the write. The relay in this module moves them to
+a notification channel that every worker listens to, so the item caches
+and the event subscribers of all workers see every committed write.
+
+On PostgreSQL the relay sends the events with NOTIFY in the transaction
+that removes them from the outbox, and each worker LISTENs on a dedicated
+connection. Other databases use an in-process transport, which is enough
+for a single worker and for the tests
+"""
+import json
+import uuid
+import select
+import logging
+import threading
+from sqlalchemy import text
+
+logger = logging.getLogger("flask.app")
+
+CHANNEL = "inventory_events"
+
+# sends a batch of payloads in one round trip, in the order of the list
+NOTIFY = text(
+    "SELECT pg_notify(:channel, event.payload) "
+    "FROM unnest(CAST(:payloads AS text[])) WITH ORDINALITY AS event(payload, position) "
+    "ORDER BY event.position"
+)
+
+
+class MemoryTransport:
+    """Delivers notifications to the listeners of this process, stands in for NOTIFY"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.listeners = []
+
+    def send(self, session, payloads):  # pylint: disable=unused-argument
+        """Delivers each payload to every listener"""
+        for payload in payloads:
+            for listener in self.listeners:
+                listener(payload)
+
+    def listen(self, listener):
+        """Calls listener with the payload of every notification"""
+        self.listeners.append(listener)
+
+    def stop(self):
+        """Forgets the listeners"""
+        self.listeners.clear()
+
+
+class NotifyTransport:
+    """Sends notifications with PostgreSQL NOTIFY and receives them with LISTEN"""
+
+    name = "notify"
+
+    def __init__(self, engine, channel=CHANNEL, timeout=5.0):
+        self.engine = engine
+        self.channel = channel
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._thread = None
+
+    def send(self, session, payloads):
+        """Queues a NOTIFY per payload with one statement, delivered when the session commits"""
+        if payloads:
+            session.execute(NOTIFY, {"channel": self.channel, "payloads": list(payloads)})
+
+    def listen(self, listener):
+        """Starts a thread that calls listener with the payload of every notification"""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._listen, args=(listener,), name="outbox-listener", daemon=True
+        )
+        self._thread.start()
+
+    def _listen(self, listener):
+        """Keeps a connection outside the pool LISTENing, reconnecting after errors"""
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = self.engine.raw_connection()
+                connection.detach()
+                driver = connection.driver_connection
+                driver.autocommit = True
+                with driver.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                while not self._stop.is_set():
+                    if select.select([driver], [], [], self.timeout) == ([], [], []):
+                        continue
+                    driver.poll()
+                    while driver.notifies:
+                        listener(driver.notifies.pop(0).payload)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Outbox listener lost its connection")
+                self._stop.wait(1.0)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def stop(self):
+        """Stops the listening thread"""
+        self._stop.set()
+
+
+class OutboxRelay:
+    """
+    Moves the events in the outbox to the notification channel and applies
+    the events written by other workers
+
+    Like the SQLAlchemy object it is created first and configured later
+    from the Flask app with init_app(). The relay thread is only started by
+    start(), so CLI commands and tests do not run it
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.transport = MemoryTransport()
+        self.batch_size = 100
+        self.poll_interval = 5.0
+        self._app = None
+        self._session = None
+        self._claim = None
+        self._handlers = []
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.relayed = 0
+        self.received = 0
+
+    def init_app(self, app, session, claim):
+        """
+        Configures the relay
+
+        Args:
+            app (Flask): the app whose settings are read
+            session (scoped_session): the session the outbox is read with
+            claim (function): removes up to a number of events from the outbox and
+                returns their payloads in order, without committing
+        """
+        self._app = app
+        self._session = session
+        self._claim = claim
+        self.batch_size = app.config.get("OUTBOX_BATCH_SIZE", 100)
+        self.poll_interval = app.config.get("OUTBOX_POLL_INTERVAL", 5.0)
+        self.transport.stop()
+        name = app.config.get("OUTBOX_TRANSPORT", "auto")
+        if name == "auto":
+            name = "notify" if session.get_bind().dialect.name == "postgresql" else "memory"
+        if name == "notify":
+            self.transport = NotifyTransport(session.get_bind())
+        elif name == "memory":
+            self.transport = MemoryTransport()
+            self.transport.listen(self.receive)
+        else:
+            raise ValueError(f"Unknown OUTBOX_TRANSPORT: {name}")
+
+    def add_handler(self, handler):
+        """Calls handler(event_type, data) for each event written by another worker"""
+        self._handlers.append(handler)
+
+    def payload(self, event_type, data):
+        """Returns the outbox payload of an event written by this worker"""
+        return json.dumps({"origin": self.origin, "type": event_type, "data": data})
+
+    def receive(self, payload):
+        """Applies an event from the channel unless this worker wrote it"""
+        event = json.loads(payload)
+        if event["origin"] == self.origin:
+            return
+        with self._lock:
+            self.received += 1
+        for handler in self._handlers:
+            handler(event["type"], event["data"])
+
+    def wake(self):
+        """Tells the relay thread that new events are waiting in the outbox"""
+        self._wake.set()
+
+    def run_once(self):
+        """Relays one batch of events and returns how many there were"""
+        payloads = self._claim(self.batch_size)
+        if payloads:
+            self.transport.send(self._session, payloads)
+        self._session.commit()
+        with self._lock:
+            self.relayed += len(payloads)
+        return len(payloads)
+
+    def start(self):
+        """Starts the relay thread and the listener once, when the setting allows it"""
+        if self._thread is not None or not self._app.config.get("OUTBOX_RELAY_THREAD", True):
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            if isinstance(self.transport, NotifyTransport):
+                self.transport.listen(self.receive)
+            self._thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Relays events when woken up, and every poll interval for events left by other workers"""
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with self._app.app_context():
+                    while self.run_once() == self.batch_size:
+                        pass
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Outbox relay failed")
+
+    def stats(self):
+        """Returns the counters used for monitoring"""
+        with self._lock:
+            return {
+                "transport": self.transport.name,
+                "running": self._thread is not None,
+                "relayed": self.relayed,
+                "received": self.received,
+            }
@@ -0,0 +1,74 @@
+"""
+Pagination helpers
+
+This module contains utility functions to build and read the opaque
+cursors used for keyset pagination and by the change feed
+"""
+import json
+import base64
+import binascii
+from datetime import datetime, timezone
+from service.models import DataValidationError
+
+
+def encode_cursor(value) -> str:
+    """Encodes a JSON serializable value into an opaque cursor string"""
+    raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Decodes a cursor string created by encode_cursor()"""
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(cursor + padding)
+        return json.loads(raw.decode("utf-8"))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as error:
+        raise DataValidationError("Invalid cursor: " + cursor) from error
+
+
+def decode_id_cursor(cursor: str) -> int:
+    """Decodes a cursor that points at the last id of a page"""
+    value = decode_cursor(cursor)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise DataValidationError("Invalid cursor: " + cursor)
+    return value
+
+
+def encode_watermark(updated_at: datetime, last_id: int) -> str:
+    """Encodes the position reached by a change feed into a cursor string"""
+    return encode_cursor([updated_at.isoformat(), last_id])
+
+
+def decode_watermark(since: str):
+    """
+    Decodes the position to read a change feed from
+
+    Args:
+        since (str): an ISO 8601 timestamp or a cursor from encode_watermark()
+
+    Returns:
+        tuple: the (datetime, id) after which changes are wanted
+    """
+    try:
+        return _parse_timestamp(since), 0
+    except ValueError:
+        pass
+    value = decode_cursor(since)
+    try:
+        timestamp, last_id = value
+        if not isinstance(last_id, int):
+            raise TypeError("id must be an int")
+        return _parse_timestamp(timestamp), last_id
+    except (AttributeError, TypeError, ValueError) as error:
+        raise DataValidationError("Invalid cursor: " + since) from error
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """Parses an ISO 8601 timestamp into a naive UTC datetime"""
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
@@ -0,0 +1,105 @@
+"""
+Connection Pool Metrics
+
+This module contains a QueuePool that measures how long requests wait to
+check out a database connection, and counts the waits that time out, so
+the pool of each worker can be sized against the database's connection limit
+"""
+import time
+import threading
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """Checkout counters shared by every pool of the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Sets the counters back to zero"""
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.errors = 0
+            self.waiting = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def started(self):
+        """Counts a caller waiting for a connection"""
+        with self._lock:
+            self.waiting += 1
+
+    def finished(self, seconds, outcome):
+        """Records how long a caller waited and whether it got a connection
+
+        Args:
+            seconds (float): the time spent in the pool
+            outcome (str): checkouts, timeouts or errors
+        """
+        with self._lock:
+            self.waiting -= 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self):
+        """Returns the counters used for monitoring"""
+        with self._lock:
+            waits = self.checkouts + self.timeouts + self.errors
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "waiting": self.waiting,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_avg": self.wait_seconds_total / waits if waits else 0.0,
+            }
+
+
+metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records every checkout in the pool metrics"""
+
+    def _do_get(self):
+        metrics.started()
+        start = time.perf_counter()
+        outcome = "errors"
+        try:
+            connection = super()._do_get()
+            outcome = "checkouts"
+            return connection
+        except PoolTimeoutError:
+            outcome = "timeouts"
+            raise
+        finally:
+            metrics.finished(time.perf_counter() - start, outcome)
+
+
+def engine_options(uri, options):
+    """Returns the engine options with the timed pool, unless the database lives in memory"""
+    if uri.startswith("sqlite") and (":memory:" in uri or uri.rstrip("/") == "sqlite:"):
+        return options
+    return {"poolclass": TimedQueuePool, **options}
+
+
+def pool_stats(engine):
+    """Returns the state of an engine's pool and the checkout metrics"""
+    pool = engine.pool
+    state = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        state.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(0, pool.overflow()),
+            timeout=pool.timeout(),
+        )
+    state.update(metrics.stats())
+    return state
@@ -0,0 +1,123 @@
+"""
+SQL Profiling
+
+This module contains an opt-in profiler of the SQL statements run by each
+request. With SQL_PROFILING it records every statement with its duration
+and row count, logs them, and adds a Server-Timing header to the response.
+With SLOW_QUERY_MS it logs the statements slower than that threshold with
+their EXPLAIN plan. When neither is set no hook is installed at all
+"""
+import time
+import logging
+import threading
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app")
+
+
+class QueryProfiler:
+    """Records the SQL statements of each request and reports the slow ones"""
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_ms = 0.0
+        self.explain = True
+        self._local = threading.local()
+        self._installed = False
+
+    def init_app(self, app):
+        """Installs the hooks the settings ask for"""
+        self.enabled = app.config.get("SQL_PROFILING", False)
+        self.slow_ms = app.config.get("SLOW_QUERY_MS", 0.0)
+        self.explain = app.config.get("SLOW_QUERY_EXPLAIN", True)
+        if not (self.enabled or self.slow_ms) or self._installed:
+            return
+        self._installed = True
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def remove(self):
+        """Removes the SQL hooks, the request hooks stay with their app"""
+        if self._installed:
+            event.remove(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.remove(Engine, "after_cursor_execute", self._after_cursor_execute)
+            self._installed = False
+
+    def statements(self):
+        """Returns the (statement, milliseconds, rows) recorded for the current request"""
+        return getattr(self._local, "statements", None) or []
+
+    def _before_request(self):
+        self._local.statements = []
+        self._local.slow = []
+        self._local.start = time.perf_counter()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # pylint: disable=unused-argument, too-many-arguments
+        conn.info.setdefault("profiling_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # pylint: disable=unused-argument, too-many-arguments
+        elapsed = (time.perf_counter() - conn.info["profiling_start"].pop()) * 1000
+        statements = getattr(self._local, "statements", None)
+        if self.enabled and statements is not None:
+            statements.append((statement, elapsed, cursor.rowcount))
+        if self.slow_ms and elapsed >= self.slow_ms:
+            slow = getattr(self._local, "slow", None)
+            if slow is None or executemany or not self.explain:
+                # outside a request there is no good time to run EXPLAIN
+                _log_slow(statement, parameters, elapsed, cursor.rowcount)
+            else:
+                slow.append((conn.engine, statement, parameters, elapsed, cursor.rowcount))
+
+    def _after_request(self, response):
+        statements = self.statements()
+        if not self.enabled or getattr(self._local, "start", None) is None:
+            return response
+        total = (time.perf_counter() - self._local.start) * 1000
+        database = sum(elapsed for _, elapsed, _ in statements)
+        response.headers["Server-Timing"] = (
+            f'db;dur={database:.2f};desc="{len(statements)} queries", app;dur={total:.2f}'
+        )
+        logger.info("%s %s ran %d SQL statements in %.2f ms", request.method, request.path,
+                    len(statements), database)
+        for statement, elapsed, rows in statements:
+            logger.debug("SQL %.2f ms, %s rows: %s", elapsed, rows, statement)
+        return response
+
+    def _teardown_request(self, error):  # pylint: disable=unused-argument
+        slow = getattr(self._local, "slow", None) or []
+        self._local.statements = self._local.slow = self._local.start = None
+        for engine, statement, parameters, elapsed, rows in slow:
+            _log_slow(statement, parameters, elapsed, rows, _explain(engine, statement, parameters))
+
+
+def _explain(engine, statement, parameters):
+    """Returns the plan of a statement from a connection of its own, or why there is none"""
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(prefix + statement, parameters)
+        plan = "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+        cursor.close()
+        return plan
+    except Exception as error:  # pylint: disable=broad-except
+        return f"no plan: {error}"
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def _log_slow(statement, parameters, elapsed, rows, plan=None):
+    """Logs a statement that took longer than SLOW_QUERY_MS"""
+    logger.warning("Slow SQL statement: %.2f ms, %s rows: %s parameters: %s%s", elapsed, rows,
+                   statement, parameters, f"\nplan:\n{plan}" if plan else "")
+
+
+profiler = QueryProfiler()
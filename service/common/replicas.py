@@ -0,0 +1,233 @@
+"""
+Read Replicas
+
+This module sends the queries of read-only requests (GET and HEAD) to the
+read replicas of DATABASE_REPLICA_URIS, so reads scale with the number of
+replicas instead of competing with the writes on the primary.
+
+A replica is only used while it is at most DB_REPLICA_MAX_LAG seconds
+behind the primary, as measured every DB_REPLICA_CHECK_INTERVAL seconds;
+otherwise the request reads the primary. A successful write also sets a
+cookie with its time, and the reads of that client stay on the primary
+until a replica has replayed it, so clients always read their own writes
+"""
+import math
+import time
+import logging
+import itertools
+import threading
+from sqlalchemy import create_engine, text
+from sqlalchemy.sql.dml import UpdateBase
+from flask_sqlalchemy.session import Session
+from service.common.pool import engine_options
+
+logger = logging.getLogger("flask.app")
+
+SESSION_KEY = "replica"
+COOKIE = "inventory_last_write"
+READ_ONLY_METHODS = ("GET", "HEAD")
+
+# seconds a replica is behind the primary, 0 when it replayed everything it received
+LAG_QUERIES = {
+    "postgresql": text(
+        "SELECT CASE WHEN NOT pg_is_in_recovery() "
+        "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    ),
+}
+# databases without replication, like SQLite, are never behind
+NO_LAG = text("SELECT 0")
+
+
+class RoutingSession(Session):
+    """A session that sends its reads to the replica engine in its info, and everything else to the primary"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get(SESSION_KEY)
+        if replica is not None and bind is None and not self._flushing \
+                and not isinstance(clause, UpdateBase):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """
+    Picks the replica, if any, that the reads of a request may use
+
+    Like the SQLAlchemy object it is created first and configured later
+    from the Flask app with init_app()
+    """
+
+    def __init__(self):
+        self.max_lag = 5.0
+        self.interval = 1.0
+        self.engines = {}
+        self._app = None
+        self._db = None
+        self._states = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._checking = threading.Lock()
+        self._thread = None
+        self.counts = dict.fromkeys(("replica", "primary", "lagging", "own_writes"), 0)
+
+    def init_app(self, app, db):
+        """Opens an engine for each replica of DATABASE_REPLICA_URIS, with the options of the primary"""
+        self._app = app
+        self._db = db
+        self.max_lag = app.config.get("DB_REPLICA_MAX_LAG", 5.0)
+        self.interval = app.config.get("DB_REPLICA_CHECK_INTERVAL", 1.0)
+        self.dispose()
+        options = {
+            name: value for name, value in app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}).items()
+            if name != "poolclass"
+        }
+        self.engines = {
+            f"replica{number}": create_engine(uri, **engine_options(uri, options))
+            for number, uri in enumerate(app.config.get("DATABASE_REPLICA_URIS") or [])
+        }
+        with self._lock:
+            self._states = {}
+            self.counts = dict.fromkeys(self.counts, 0)
+
+    def dispose(self):
+        """Closes the connections of every replica"""
+        for engine in self.engines.values():
+            engine.dispose()
+        self.engines = {}
+
+    def check(self):
+        """Measures the lag of every replica and caches it"""
+        for name, engine in list(self.engines.items()):
+            try:
+                with engine.connect() as connection:
+                    lag = connection.execute(LAG_QUERIES.get(connection.dialect.name, NO_LAG)).scalar()
+                state = {"ok": lag is not None, "lag": None if lag is None else float(lag), "error": None}
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Replica %s cannot be checked: %s", name, error)
+                state = {"ok": False, "lag": None, "error": str(error)}
+            state["checked_at"] = time.time()
+            with self._lock:
+                self._states[name] = state
+
+    def route(self, read_only, last_write=None):
+        """
+        Sends the reads of the current request to a replica that is up to date
+
+        Args:
+            read_only (bool): whether the request only reads, the others use the primary
+            last_write (str): the cookie holding the time of the last write of the client
+        """
+        session = self._db.session()
+        session.info[SESSION_KEY] = None
+        if not read_only or not self.engines:
+            return None
+        if self._thread is None and self._stale() and self._checking.acquire(blocking=False):
+            # without the background thread one request at a time runs the checks
+            try:
+                self.check()
+            finally:
+                self._checking.release()
+        name, reason = self._pick(_parse_time(last_write))
+        with self._lock:
+            self.counts["replica" if name else "primary"] += 1
+            if reason:
+                self.counts[reason] += 1
+        if name is not None:
+            session.info[SESSION_KEY] = self.engines[name]
+        return name
+
+    def reading(self):
+        """Returns whether the reads of the current request go to a replica"""
+        return self._db.session().info.get(SESSION_KEY) is not None
+
+    def remember_write(self, response):
+        """Gives the client of a successful write the cookie that keeps its reads on the primary"""
+        if self.engines and response.status_code < 400:
+            # after DB_REPLICA_MAX_LAG seconds every replica that is used has replayed the write
+            response.set_cookie(COOKIE, f"{time.time():.6f}", max_age=math.ceil(self.max_lag),
+                                httponly=True, samesite="Lax")
+        return response
+
+    def _stale(self):
+        """Returns whether a replica was not checked for an interval"""
+        now = time.time()
+        with self._lock:
+            states = [self._states.get(name) for name in self.engines]
+        return any(state is None or now - state["checked_at"] >= self.interval for state in states)
+
+    def _pick(self, last_write):
+        """
+        Returns the replica to read from, or None, and why the primary was chosen instead
+
+        A replica is usable when the data it replayed, as of its last check, is
+        at most max_lag seconds old, and includes the last write of the client
+        """
+        now = time.time()
+        with self._lock:
+            states = dict(self._states)
+        usable, behind_write = [], False
+        for name in self.engines:
+            state = states.get(name)
+            if state is None or not state["ok"]:
+                continue
+            replayed = state["checked_at"] - state["lag"]
+            if now - replayed > self.max_lag:
+                continue
+            if last_write is not None and replayed < last_write:
+                behind_write = True
+                continue
+            usable.append(name)
+        if usable:
+            return usable[next(self._turn) % len(usable)], None
+        return None, "own_writes" if behind_write else "lagging"
+
+    def start(self):
+        """Starts the background checks once, when there are replicas and the setting allows it"""
+        if self._thread is not None or not self.engines \
+                or not self._app.config.get("DB_REPLICA_CHECK_THREAD", True):
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="replica-check", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Checks every interval until the process ends"""
+        while True:
+            try:
+                self.check()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Replica check failed")
+            time.sleep(self.interval)
+
+    def stats(self):
+        """Returns the state of the replicas and the counters used for monitoring"""
+        with self._lock:
+            states = dict(self._states)
+            counts = dict(self.counts)
+        return {
+            "replicas": {
+                name: {
+                    "ok": state["ok"],
+                    "lag_seconds": state["lag"],
+                    "error": state["error"],
+                    "checked_seconds_ago": round(time.time() - state["checked_at"], 3),
+                } if state else None
+                for name, state in ((name, states.get(name)) for name in self.engines)
+            },
+            "reads": {"replica": counts["replica"], "primary": counts["primary"]},
+            "fallbacks": {"lagging": counts["lagging"], "own_writes": counts["own_writes"]},
+        }
+
+
+def _parse_time(value):
+    """Returns the time of a last write cookie, never later than now, or None"""
+    try:
+        return min(float(value), time.time()) if value else None
+    except ValueError:
+        return None
+
+
+replicas = ReplicaRouter()
@@ -12,5 +12,95 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker. Size it so that workers x replicas x
+# (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays below PostgreSQL's max_connections.
+# SQLite keeps the pool Flask-SQLAlchemy chooses for it
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+}
+if not DATABASE_URI.startswith("sqlite"):
+    SQLALCHEMY_ENGINE_OPTIONS.update(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    )
+
+# Read replicas: a comma-separated list of URIs for the reads of GET requests.
+# A replica more than DB_REPLICA_MAX_LAG seconds behind the primary, as checked
+# every DB_REPLICA_CHECK_INTERVAL seconds, is skipped for the primary
+DATABASE_REPLICA_URIS = [
+    uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()
+]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "1"))
+DB_REPLICA_CHECK_THREAD = os.getenv("DB_REPLICA_CHECK_THREAD", "true").lower() == "true"
+
+# Database of the async serving mode (service.asgi), by default DATABASE_URI
+# with the asyncpg or aiosqlite driver
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI")
+
+# Number of rows fetched per round trip when streaming the inventory export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Number of items inserted and committed together by the bulk create endpoint
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Maximum number of changed items returned by one page of the change feed
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "500"))
+
+# Restock report: seconds a report is reused before it is computed again (0
+# computes every request), and the most depleted items a report may list
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "10"))
+REPORT_TOP_MAX = int(os.getenv("REPORT_TOP_MAX", "100"))
+
+# Change events: events kept for Last-Event-ID replay, events queued per
+# subscriber before it is dropped, and seconds between keep-alive comments
+EVENTS_HISTORY = int(os.getenv("EVENTS_HISTORY", "1000"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+# Each open event stream holds one of the GUNICORN_THREADS threads of its worker,
+# so by default streams may hold half of them and the others keep serving requests
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv(
+    "EVENTS_MAX_SUBSCRIBERS", str(max(1, int(os.getenv("GUNICORN_THREADS", "4")) // 2))
+))
+
+# Outbox relay that sends change events to every worker: the transport is
+# notify (PostgreSQL LISTEN/NOTIFY), memory (this process only) or auto
+OUTBOX_TRANSPORT = os.getenv("OUTBOX_TRANSPORT", "auto")
+OUTBOX_RELAY_THREAD = os.getenv("OUTBOX_RELAY_THREAD", "true").lower() == "true"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+
+# Item cache used by Inventory.find: memory, redis or none
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "10"))
+CACHE_MAX_ITEMS = int(os.getenv("CACHE_MAX_ITEMS", "4096"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Readiness checks: seconds between database probes, and the number of checks
+# in a row that must find the pool exhausted before the worker is not ready
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "5"))
+HEALTH_SATURATED_CHECKS = int(os.getenv("HEALTH_SATURATED_CHECKS", "3"))
+HEALTH_CHECK_THREAD = os.getenv("HEALTH_CHECK_THREAD", "true").lower() == "true"
+
+# SQL profiling: SQL_PROFILING logs the statements of each request and adds a
+# Server-Timing header, SLOW_QUERY_MS logs slower statements with their plan
+SQL_PROFILING = os.getenv("SQL_PROFILING", "false").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+
+# Logging: LOG_FORMAT is text or json, LOG_QUEUE writes the records from a
+# thread through a queue of LOG_QUEUE_SIZE records, and LOG_SAMPLING keeps a
+# fraction of the info records of some loggers, such as "flask.app=0.1"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+
+# Directory shared by the gunicorn workers so /metrics reports all of them,
+# unset to report the metrics of the worker that answers the scrape
+METRICS_DIR = os.getenv("METRICS_DIR")
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
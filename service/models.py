@@ -6,6 +6,8 @@ All of the models are stored in this module
 Models
 ------
 Inventory - An Inventory item used in the Inventory
+InventoryTombstone - A record that an Inventory item was deleted
+InventoryOutbox - A change event waiting to be relayed to every worker
 
 Attributes:
 -----------
@@ -17,14 +19,36 @@ restock_level (number) - the restock level of the Inventory item
 """
 # pylint: disable=import-error, superfluous-parens
 import logging
+import hashlib
 from enum import Enum
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert, update, delete, select, func, or_, and_
+from sqlalchemy.orm import make_transient_to_detached
+from service.common.cache import ItemCache, LRUCache
+from service.common.events import EventBroker
+from service.common.outbox import OutboxRelay
+from service.common.pool import engine_options
+from service.common.replicas import RoutingSession, replicas
 
 logger = logging.getLogger("flask.app")
 
-# Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Create the SQLAlchemy object to be initialized later in init_db(), its
+# sessions read from the replica chosen for the request
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+# Create the item cache to be configured later in init_db()
+cache = ItemCache()
+
+# Create the change event broker to be configured later in init_db()
+events = EventBroker()
+
+# Create the outbox relay to be configured later in init_db()
+relay = OutboxRelay()
+
+# Create the cache of the restock reports, one per number of items listed,
+# to be configured later in init_db()
+reports = LRUCache(maxsize=128, ttl=0)
 
 
 # Function to initialize the database
@@ -33,6 +57,32 @@ def init_db(app):
     Inventory.init_db(app)
 
 
+def _commit(published):
+    """
+    Commits the session with its change events added to the outbox, then
+    applies them to the item cache and the subscribers of this worker
+
+    Args:
+        published (list): (event type, serialized item) pairs
+    """
+    InventoryOutbox.record([relay.payload(event_type, data) for event_type, data in published])
+    db.session.commit()
+    if published:
+        relay.wake()
+    for event_type, data in published:
+        _apply_event(event_type, data)
+
+
+def _apply_event(event_type, data):
+    """Drops the cached copy of the item an event wrote and publishes the event"""
+    cache.invalidate(data["id"])
+    events.publish(event_type, data)
+
+
+# Events written by other workers arrive through the relay
+relay.add_handler(_apply_event)
+
+
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
 
@@ -45,12 +95,52 @@ class Condition(Enum):
     USED = 2
 
 
+def _name(value):
+    """ Validates an Inventory item name """
+    if not value or not isinstance(value, str):
+        raise DataValidationError("[Name] cannot be empty")
+    return value
+
+
+def _condition(value):
+    """ Validates an Inventory item condition name """
+    try:
+        return getattr(Condition, str(value))
+    except AttributeError as error:
+        raise DataValidationError("Invalid attribute: " + error.args[0]) from error
+
+
+def _int(field):
+    """ Returns a validator for an integer field """
+    def validate(value):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise DataValidationError(f"Invalid type for int [{field}]: " + str(type(value)))
+        return value
+    return validate
+
+
+def _positive_int(field, value):
+    """ Validates a positive integer such as an id """
+    if _int(field)(value) <= 0:
+        raise DataValidationError(f"Invalid {field}: " + str(value))
+    return value
+
+
+# Validators for the fields that can be changed by a partial update
+CHANGE_DESERIALIZERS = {
+    "name": _name,
+    "condition": _condition,
+    "quantity": _int("quantity"),
+    "restock_level": _int("restock_level"),
+}
+
+
 def updated_at_default(context):
     """ Initializes the created_at time """
     return context.get_current_parameters()["created_at"]
 
 
-class Inventory(db.Model):
+class Inventory(db.Model):  # pylint: disable=too-many-public-methods
     """
     Class that represents a Inventory
     """
@@ -60,13 +150,31 @@ class Inventory(db.Model):
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(63), nullable=False)
-    condition = db.Column(db.Enum(Condition), nullable=False, server_default=(Condition.NEW.name))
-    quantity = db.Column(db.Integer, nullable=False)
+    condition = db.Column(
+        db.Enum(Condition), nullable=False, server_default=(Condition.NEW.name), index=True)
+    quantity = db.Column(db.Integer, nullable=False, index=True)
     restock_level = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(
         db.DateTime, nullable=False, default=updated_at_default, onupdate=datetime.utcnow)
 
+    # The pattern index serves both name equality and name prefix queries,
+    # the expression index supports the restock queries
+    __table_args__ = (
+        db.Index("ix_inventory_name_pattern", name,
+                 postgresql_ops={"name": "varchar_pattern_ops"}),
+        db.Index("ix_inventory_restock_gap", quantity - restock_level),
+        db.Index("ix_inventory_updated_at", updated_at, id),
+    )
+
+    # Names of the fields produced by serialize()
+    FIELDS = ("id", "name", "condition", "quantity", "restock_level")
+
+    # Names of the filters accepted by find_by_filters()
+    FILTERS = (
+        "name", "name_prefix", "condition", "restock", "quantity", "quantity_min", "quantity_max"
+    )
+
     def __repr__(self):
         return f"<Inventory item: id={self.id}, name={self.name}, condition={self.condition}>"
 
@@ -80,7 +188,38 @@ class Inventory(db.Model):
         self.created_at = None
         self.updated_at = None
         db.session.add(self)
-        db.session.commit()
+        db.session.flush()
+        _commit([("create", self.serialize())])
+
+    @classmethod
+    def create_many(cls, items):
+        """
+        Creates many Inventory items with a single multi-row INSERT
+        and one commit
+
+        Args:
+            items (list): deserialized Inventory items to insert
+
+        Returns:
+            list: the ids assigned to the new Inventory items
+        """
+        logger.info("Creating %d Inventory items", len(items))
+        now = datetime.utcnow()
+        rows = [
+            {
+                "name": item.name,
+                "condition": item.condition,
+                "quantity": item.quantity,
+                "restock_level": item.restock_level,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for item in items
+        ]
+        created = db.session.execute(insert(cls).returning(*cls.columns()), rows).all()
+        serialize = cls.row_serializer(cls.FIELDS)
+        _commit([("create", serialize(row)) for row in created])
+        return [row.id for row in created]
 
     def update(self):
         """
@@ -90,13 +229,174 @@ class Inventory(db.Model):
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
         self.updated_at = datetime.utcnow()
-        db.session.commit()
+        _commit([("update", self.serialize())])
+
+    @classmethod
+    def update_many(cls, changes):
+        """
+        Updates many Inventory items by id in one transaction
+
+        Args:
+            changes (list): dictionaries from deserialize_changes(), each with an id
+
+        Returns:
+            list: the ids of the Inventory items that were updated
+        """
+        logger.info("Updating %d Inventory items", len(changes))
+        wanted = {change["id"] for change in changes}
+        found = {
+            row.id: cls.serialize_row(row, cls.FIELDS)
+            for row in db.session.execute(select(*cls.columns()).where(cls.id.in_(wanted)))
+        }
+        now = datetime.utcnow()
+        rows = [dict(change, updated_at=now) for change in changes if change["id"] in found]
+        if rows:
+            db.session.execute(update(cls), rows)
+        for row in rows:
+            # the events carry the values read before the update with the changes applied
+            found[row["id"]].update(
+                (field, value.name if field == "condition" else value)
+                for field, value in row.items() if field in cls.FIELDS
+            )
+        _commit([("update", found[by_id]) for by_id in sorted(found)])
+        return sorted(found)
+
+    @classmethod
+    def update_matching(cls, query, changes):
+        """
+        Applies the same changes to every Inventory item matched by a query
+        with a single UPDATE statement
+
+        Args:
+            query (Query): a query returned by one of the find methods
+            changes (dict): a dictionary from deserialize_changes() without an id
+
+        Returns:
+            list: the ids of the Inventory items that were updated
+        """
+        logger.info("Updating Inventory items matching %s", query.whereclause)
+        statement = (
+            update(cls)
+            .where(query.whereclause)
+            .values(updated_at=datetime.utcnow(), **changes)
+            .returning(*cls.columns())
+        )
+        updated = db.session.execute(statement).all()
+        serialize = cls.row_serializer(cls.FIELDS)
+        _commit([("update", serialize(row)) for row in updated])
+        return [row.id for row in updated]
+
+    @classmethod
+    def delete_many(cls, query):
+        """
+        Removes every Inventory item matched by a query with a single DELETE statement
+
+        Args:
+            query (Query): a query returned by one of the find methods
+
+        Returns:
+            list: the ids of the Inventory items that were removed
+        """
+        logger.info("Deleting Inventory items matching %s", query.whereclause)
+        ids = db.session.scalars(delete(cls).where(query.whereclause).returning(cls.id)).all()
+        InventoryTombstone.record(ids)
+        _commit([("delete", {"id": by_id}) for by_id in ids])
+        return ids
+
+    @classmethod
+    def adjust_quantity(cls, by_id, delta, floor_at_zero=False):
+        """
+        Adds a signed delta to the quantity of an Inventory item with a single
+        UPDATE ... RETURNING statement so concurrent adjustments are not lost
+
+        Args:
+            by_id (int): the id of the Inventory item
+            delta (int): the amount to add to the quantity, negative to remove stock
+            floor_at_zero (bool): do not apply a delta that would make the quantity negative
+
+        Returns:
+            Inventory: the updated item, or None when no row matched
+        """
+        logger.info("Adjusting quantity of id %s by %s", by_id, delta)
+        return cls._update_returning(cls.adjust_statement(by_id, delta, floor_at_zero))
+
+    @classmethod
+    def adjust_statement(cls, by_id, delta, floor_at_zero=False):
+        """Returns the UPDATE ... RETURNING statement of adjust_quantity()"""
+        statement = update(cls).where(cls.id == cls.validate_id(by_id))
+        if floor_at_zero:
+            statement = statement.where(cls.quantity + delta >= 0)
+        return cls._returning(statement.values(quantity=cls.quantity + delta))
+
+    @classmethod
+    def restock(cls, by_id):
+        """
+        Restocks an Inventory item to one above its restock level with a single
+        UPDATE ... RETURNING statement
+
+        Args:
+            by_id (int): the id of the Inventory item
+
+        Returns:
+            Inventory: the restocked item, or None when the item does not exist
+            or is already above its restock level
+        """
+        logger.info("Restocking id %s", by_id)
+        return cls._update_returning(cls.restock_statement(by_id), "restock")
+
+    @classmethod
+    def restock_statement(cls, by_id):
+        """Returns the UPDATE ... RETURNING statement of restock()"""
+        statement = (
+            update(cls)
+            .where(cls.id == cls.validate_id(by_id), cls.quantity <= cls.restock_level)
+            .values(quantity=cls.restock_level + 1)
+        )
+        return cls._returning(statement)
+
+    @classmethod
+    def _returning(cls, statement):
+        """Stamps an UPDATE statement with the time and makes it return the updated item"""
+        return statement.values(updated_at=datetime.utcnow()).returning(cls)
+
+    @classmethod
+    def _update_returning(cls, statement, event_type="update"):
+        """Runs an UPDATE of at most one row, publishes event_type and returns the updated item"""
+        item = db.session.scalars(statement).one_or_none()
+        published = []
+        if item is not None:
+            # detach the item so the commit does not expire it and force a reload
+            db.session.expunge(item)
+            published.append((event_type, item.serialize()))
+        _commit(published)
+        return item
 
     def delete(self):
         """ Removes an Inventory item from the data store """
         logger.info("Deleting %s", self.name)
         db.session.delete(self)
-        db.session.commit()
+        db.session.add(InventoryTombstone(inventory_id=self.id))
+        _commit([("delete", {"id": self.id})])
+
+    @property
+    def etag(self):
+        """ An entity tag that changes whenever the Inventory item is written """
+        version = f"{self.id}:{self.updated_at.isoformat()}"
+        return hashlib.sha1(version.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def rows_version(rows):
+        """Returns a value that changes whenever an item of some listed rows is
+        created, written or removed, from the id and the update time of each row
+
+        The rows of a page are enough: an item created or removed in the range
+        of the page adds or moves one of its rows
+
+        Args:
+            rows (list): rows starting with the id and ending with the update time
+        """
+        version = "|".join(f"{row[0]}:{row[-1].isoformat()}" for row in rows)
+        return hashlib.sha1(version.encode("utf-8")).hexdigest()
 
     def serialize(self):
         """ Serializes an Inventory item into a dictionary """
@@ -108,6 +408,68 @@ class Inventory(db.Model):
             "restock_level": self.restock_level
             }
 
+    @staticmethod
+    def serialize_row(row, fields):
+        """ Serializes some fields of a row returned by select_fields() into a dictionary """
+        data = row._mapping  # pylint: disable=protected-access
+        return {
+            field: data[field].name if field == "condition" else data[field]
+            for field in fields
+        }
+
+    @staticmethod
+    def row_serializer(fields):
+        """
+        Returns a function that serializes the rows returned by select_fields()
+
+        The position of each field in the rows is worked out once, so serializing
+        a long list does not look up every field of every row by name
+
+        Columns added after those of select_fields() are left out
+
+        Args:
+            fields (list): the names of the fields given to select_fields()
+        """
+        names = ("id",) + tuple(field for field in fields if field != "id")
+        with_condition = "condition" in names
+        with_id = "id" in fields
+
+        def serialize(row):
+            data = dict(zip(names, row))
+            if with_condition:
+                data["condition"] = data["condition"].name
+            if not with_id:
+                del data["id"]
+            return data
+        return serialize
+
+    def _to_cache(self):
+        """ Serializes every column of an Inventory item for the item cache """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "condition": self.condition.name,
+            "quantity": self.quantity,
+            "restock_level": self.restock_level,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+    @classmethod
+    def _from_cache(cls, data):
+        """ Attaches an Inventory item read from the item cache to the session """
+        item = cls(
+            id=data["id"],
+            name=data["name"],
+            condition=getattr(Condition, data["condition"]),
+            quantity=data["quantity"],
+            restock_level=data["restock_level"],
+            created_at=datetime.fromisoformat(data["created_at"]),
+            updated_at=datetime.fromisoformat(data["updated_at"]),
+        )
+        make_transient_to_detached(item)
+        return db.session.merge(item, load=False)
+
     def deserialize(self, data):
         """
         Deserializes an Inventory item from a dictionary
@@ -152,51 +514,335 @@ class Inventory(db.Model):
             ) from error
         return self
 
+    @classmethod
+    def deserialize_changes(cls, data, with_id=True):
+        """
+        Deserializes the fields to change on an Inventory item from a partial dictionary
+
+        Args:
+            data (dict): A dictionary containing some of the resource data
+            with_id (bool): whether the dictionary must name the item by its id
+        """
+        if not isinstance(data, dict):
+            raise DataValidationError(
+                "Invalid Inventory item: body of request contained bad or no data"
+            )
+        changes = {}
+        if with_id:
+            changes["id"] = _positive_int("id", data.get("id"))
+        for field, value in data.items():
+            if field in CHANGE_DESERIALIZERS:
+                changes[field] = CHANGE_DESERIALIZERS[field](value)
+        if len(changes) == int(with_id):
+            raise DataValidationError("Invalid Inventory item: no fields to change")
+        return changes
+
     @classmethod
     def init_db(cls, app):
         """ Initializes the database session """
         logger.info("Initializing database")
         cls.app = app
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+            app.config["SQLALCHEMY_DATABASE_URI"], app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+        )
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        replicas.init_app(app, db)
+        cache.init_app(app)
+        reports.ttl = app.config.get("REPORT_CACHE_TTL", 10.0)
+        reports.clear()
+        events.init_app(app)
+        # requests get their own session, which is removed with their app context
+        with app.app_context():
+            relay.init_app(app, db.session, InventoryOutbox.claim)
+
+    @classmethod
+    def paginate(cls, query, cursor=None, limit=None):
+        """Applies keyset pagination to a query
+
+        Args:
+            query (Query): the query to paginate, or a Select statement
+            cursor (int): only return Inventory items with an id greater than this
+            limit (int): the maximum number of Inventory items to return
+        """
+        if cursor is None and limit is None:
+            return query
+        if cursor is not None:
+            query = query.filter(cls.id > cursor)
+        query = query.order_by(cls.id)
+        if limit is not None:
+            if limit <= 0:
+                raise DataValidationError("Limit must be positive: " + str(limit))
+            query = query.limit(limit)
+        return query
 
     @classmethod
-    def all(cls):
+    def select_fields(cls, query, fields):
+        """Restricts a query to the columns of some fields
+
+        The query returns plain rows instead of Inventory items, always
+        including the id so the rows can still be paginated
+
+        Args:
+            query (Query): a query returned by one of the find methods
+            fields (list): names from FIELDS
+        """
+        return query.with_entities(*cls.field_columns(fields))
+
+    @classmethod
+    def field_columns(cls, fields):
+        """Returns the id column followed by the columns of some fields
+
+        Args:
+            fields (list): names from FIELDS
+        """
+        for field in fields:
+            if field not in cls.FIELDS:
+                raise DataValidationError("Invalid field in query: " + str(field))
+        names = ["id"] + [field for field in fields if field != "id"]
+        return [getattr(cls, name) for name in names]
+
+    @classmethod
+    def columns(cls):
+        """ Returns the columns serialized by serialize_row() and row_serializer() """
+        return [getattr(cls, field) for field in cls.FIELDS]
+
+    @classmethod
+    def all(cls, cursor=None, limit=None):
         """ Returns all of the Inventory items in the database """
         logger.info("Processing all Inventory items")
-        return cls.query.all()
+        return cls.paginate(cls.query, cursor, limit).all()
 
     @classmethod
-    def find(cls, by_id):
-        """ Finds an Inventory item by it's ID """
+    def iter_all(cls, batch_size):
+        """Streams all of the Inventory items in the database ordered by id
+
+        Args:
+            batch_size (int): the number of rows fetched from the cursor at a time
+        """
+        logger.info("Streaming all Inventory items in batches of %d", batch_size)
+        return cls.query.order_by(cls.id).yield_per(batch_size)
+
+    @classmethod
+    def find(cls, by_id, cached=True):
+        """ Finds an Inventory item by it's ID
+
+        Args:
+            by_id (int/string): the id of the Inventory item
+            cached (bool): consult the item cache, callers that write
+                the item should read it from the database instead
+        """
         logger.info("Processing lookup for id %s ...", by_id)
+        by_id = cls.validate_id(by_id)
+        if not cached:
+            return cls.query.get(by_id)
+        data = cache.get(by_id)
+        if data is not None:
+            return cls._from_cache(data)
+        item = cls.query.get(by_id)
+        # a replica may still return the version a write just dropped from the cache
+        if item is not None and not replicas.reading():
+            cache.set(by_id, item._to_cache())  # pylint: disable=protected-access
+        return item
+
+    @classmethod
+    def find_for_update(cls, by_id):
+        """ Finds an Inventory item by it's ID and locks its row until the next commit """
+        logger.info("Processing locked lookup for id %s ...", by_id)
+        return db.session.get(cls, cls.validate_id(by_id), with_for_update=True)
+
+    @staticmethod
+    def validate_id(by_id):
+        """ Validates an id given as an int or as a string of digits """
         if not isinstance(by_id, int):
-            if not by_id.isdigit():
+            # isdigit() would let through digits int() rejects, such as superscripts
+            if not by_id.isdecimal():
                 raise DataValidationError("Invalid ID: " + by_id)
         elif by_id <= 0:
             raise DataValidationError("ID must be positive: " + str(by_id))
-        return cls.query.get(by_id)
+        return int(by_id)
+
+    @staticmethod
+    def validate_adjustment(data):
+        """ Validates the body of an adjustment and returns its delta and floor_at_zero """
+        data = data if isinstance(data, dict) else {}
+        delta = data.get("delta")
+        if not isinstance(delta, int) or isinstance(delta, bool):
+            raise DataValidationError("Invalid type for int [delta]: " + str(type(delta)))
+        # only a JSON boolean, so "false" or 0 are not read as truthy values
+        floor_at_zero = data.get("floor_at_zero", False)
+        if not isinstance(floor_at_zero, bool):
+            raise DataValidationError(
+                "Invalid type for bool [floor_at_zero]: " + str(type(floor_at_zero))
+            )
+        return delta, floor_at_zero
+
+    @classmethod
+    def find_changes(cls, since, after_id, limit):
+        """Returns the Inventory items written after a watermark, oldest first
+
+        Args:
+            since (datetime): only items updated at or after this time
+            after_id (int): among the items updated exactly at since, only those with a greater id
+            limit (int): the maximum number of Inventory items to return
+        """
+        logger.info("Processing changes since %s, %s ...", since, after_id)
+        return (
+            cls.query.filter(
+                or_(cls.updated_at > since, and_(cls.updated_at == since, cls.id > after_id))
+            )
+            .order_by(cls.updated_at, cls.id)
+            .limit(limit)
+            .all()
+        )
+
+    @classmethod
+    def find_by_ids(cls, ids):
+        """Returns all Inventory items with one of the given ids
+
+        Args:
+            ids (list): the ids of the Inventory items you want to match
+        """
+        logger.info("Processing id query for %d ids ...", len(ids))
+        return cls.query.filter(cls.id.in_(ids))
 
     @classmethod
-    def find_by_name(cls, name):
+    def find_by_filters(cls, filters, cursor=None, limit=None):
+        """Returns all Inventory items that match every one of the given filters
+
+        Args:
+            filters (dict): values for any of the names in FILTERS, None values are ignored
+            cursor, limit (int): optional keyset pagination, see paginate()
+        """
+        logger.info("Processing combined query for %s ...", filters)
+        return cls.paginate(cls.query.filter(*cls.criteria(filters)), cursor, limit)
+
+    @classmethod
+    def criteria(cls, filters):
+        """Returns the WHERE criteria of the given filters, see find_by_filters()"""
+        criteria = []
+        for key, value in filters.items():
+            if key not in cls.FILTERS:
+                raise DataValidationError("Invalid filter in query: " + str(key))
+            if value is not None:
+                criteria.append(getattr(cls, f"_{key}_criterion")(value))
+        return criteria
+
+    @classmethod
+    def find_by_name(cls, name, cursor=None, limit=None):
         """Returns all Inventory items with the given name
 
         Args:
             name (string): the name of the Inventory item you want to match
+            cursor, limit (int): optional keyset pagination, see paginate()
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        return cls.paginate(cls.query.filter(cls._name_criterion(name)), cursor, limit)
 
     @classmethod
-    def find_by_condition(cls, condition):
+    def find_by_condition(cls, condition, cursor=None, limit=None):
         """Returns all Inventory items with the given condition
 
         Args:
             condition (enum/string): the condition of the Inventory item you want to match
+            cursor, limit (int): optional keyset pagination, see paginate()
         """
         logger.info("Processing condition query for %s ...", condition)
+        return cls.paginate(cls.query.filter(cls._condition_criterion(condition)), cursor, limit)
+
+    @classmethod
+    def find_by_restock_level(cls, restock, cursor=None, limit=None):
+        """Returns all inventory items that need to or don't need to be restocked
+
+        Args:
+            restock (string): true/True/false/False
+            cursor, limit (int): optional keyset pagination, see paginate()
+        """
+        logger.info("Processing query for restock condition %s ...", restock)
+        return cls.paginate(cls.query.filter(cls._restock_criterion(restock)), cursor, limit)
+
+    @classmethod
+    def restock_report(cls, top=10):
+        """Summarizes the Inventory items that need to be restocked
+
+        A single query counts the items and sums their shortfall
+        (restock_level - quantity) per condition with window functions, and
+        only returns the rows of the top most depleted items and one row per
+        condition to read the sums from. Reports are reused for REPORT_CACHE_TTL
+        seconds, writes do not refresh them
+
+        Args:
+            top (int): the number of most depleted items to list
+        """
+        report = reports.get(top) if reports.ttl > 0 else None
+        if report is not None:
+            return report
+        logger.info("Processing restock report of the %d most depleted items", top)
+        shortfall = cls.restock_level - cls.quantity
+        ranked = (
+            select(
+                cls.id, cls.name, cls.condition, cls.quantity, cls.restock_level,
+                shortfall.label("shortfall"),
+                func.count().over(partition_by=cls.condition).label("condition_items"),
+                func.sum(shortfall).over(partition_by=cls.condition).label("condition_shortfall"),
+                func.row_number().over(order_by=(shortfall.desc(), cls.id)).label("rank"),
+                func.row_number().over(partition_by=cls.condition, order_by=cls.id)
+                .label("condition_rank"),
+            )
+            .where(cls._restock_criterion("true"))
+            .subquery()
+        )
+        rows = db.session.execute(
+            select(ranked)
+            .where(or_(ranked.c.rank <= top, ranked.c.condition_rank == 1))
+            .order_by(ranked.c.rank)
+        ).all()
+        fields = cls.FIELDS + ("shortfall",)
+        by_condition = {condition.name: {"items": 0, "shortfall": 0} for condition in Condition}
+        for row in rows:
+            by_condition[row.condition.name] = {
+                "items": row.condition_items, "shortfall": int(row.condition_shortfall)
+            }
+        report = {
+            "generated_at": datetime.utcnow().isoformat() + "Z",
+            "items": sum(totals["items"] for totals in by_condition.values()),
+            "shortfall": sum(totals["shortfall"] for totals in by_condition.values()),
+            "by_condition": by_condition,
+            "most_depleted": [
+                cls.serialize_row(row, fields) for row in rows if row.rank <= top
+            ],
+        }
+        if reports.ttl > 0:
+            reports.set(top, report)
+        return report
+
+    @classmethod
+    def find_by_quantity(cls, quantity, cursor=None, limit=None):
+        """Returns all inventory items with the given quantity
+
+        Args:
+            quantity (string): a string that must be able to be converted into an integer
+            cursor, limit (int): optional keyset pagination, see paginate()
+        """
+        logger.info("Processing quantity query for %s ...", quantity)
+        return cls.paginate(cls.query.filter(cls._quantity_criterion(quantity)), cursor, limit)
+
+    ##################################################
+    # Filter criteria used by the find methods
+    ##################################################
+
+    @classmethod
+    def _name_criterion(cls, name):
+        return cls.name == name
+
+    @classmethod
+    def _name_prefix_criterion(cls, prefix):
+        # an explicit LIKE 'prefix%' lets PostgreSQL use ix_inventory_name_pattern
+        escaped = prefix.replace("/", "//").replace("%", "/%").replace("_", "/_")
+        return cls.name.like(escaped + "%", escape="/")
+
+    @classmethod
+    def _condition_criterion(cls, condition):
         try:
             if not isinstance(condition, Condition):
                 query_condition = getattr(Condition, condition)
@@ -207,30 +853,126 @@ class Inventory(db.Model):
                 "Invalid condition in query: "
                 + condition
             ) from error
-        return cls.query.filter(cls.condition == query_condition)
+        return cls.condition == query_condition
 
     @classmethod
-    def find_by_restock_level(cls, restock):
-        """Returns all inventory items that need to or don't need to be restocked
-
-        Args:
-            restock (string): true/True/false/False
-        """
-        logger.info("Processing query for restock condition %s ...", restock)
+    def _restock_criterion(cls, restock):
         if restock not in ["true", "True", "false", "False"]:
             raise DataValidationError("Invalid restock query string: " + str(restock))
+        # written against the indexed expression so the planner can use ix_inventory_restock_gap
         if restock in ["true", "True"]:
-            return cls.query.filter(cls.quantity <= cls.restock_level)
-        return cls.query.filter(cls.quantity > cls.restock_level)
+            return cls.quantity - cls.restock_level <= 0
+        return cls.quantity - cls.restock_level > 0
+
+    @staticmethod
+    def _quantity_value(quantity):
+        if not quantity.isdecimal():
+            raise DataValidationError("Invalid quantity in query: " + str(quantity))
+        return int(quantity)
 
     @classmethod
-    def find_by_quantity(cls, quantity):
-        """Returns all inventory items with the given quantity
+    def _quantity_criterion(cls, quantity):
+        return cls.quantity == cls._quantity_value(quantity)
+
+    @classmethod
+    def _quantity_min_criterion(cls, quantity):
+        return cls.quantity >= cls._quantity_value(quantity)
+
+    @classmethod
+    def _quantity_max_criterion(cls, quantity):
+        return cls.quantity <= cls._quantity_value(quantity)
+
+
+class InventoryTombstone(db.Model):
+    """
+    Class that records the deletion of an Inventory item so that
+    incremental sync clients can learn about it
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    inventory_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<Inventory tombstone: id={self.inventory_id}, deleted_at={self.deleted_at}>"
+
+    @classmethod
+    def record(cls, inventory_ids):
+        """Adds tombstones for deleted Inventory items to the current transaction"""
+        if inventory_ids:
+            now = datetime.utcnow()
+            db.session.execute(
+                insert(cls), [{"inventory_id": by_id, "deleted_at": now} for by_id in inventory_ids]
+            )
+
+    @classmethod
+    def find_since(cls, since, after_id, limit):
+        """Returns the tombstones recorded after a watermark, oldest first
 
         Args:
-            quantity (string): a string that must be able to be converted into an integer
+            since (datetime): only tombstones recorded at or after this time
+            after_id (int): among the tombstones recorded exactly at since, only
+                those of a greater Inventory item id
+            limit (int): the maximum number of tombstones to return
         """
-        logger.info("Processing quantity query for %s ...", quantity)
-        if not quantity.isdigit():
-            raise DataValidationError("Invalid quantity in query: " + str(quantity))
-        return cls.query.filter(cls.quantity == int(quantity))
+        logger.info("Processing deletions since %s, %s ...", since, after_id)
+        at_since = and_(cls.deleted_at == since, cls.inventory_id > after_id)
+        return (
+            cls.query.filter(or_(cls.deleted_at > since, at_since))
+            .order_by(cls.deleted_at, cls.inventory_id)
+            .limit(limit)
+            .all()
+        )
+
+    @classmethod
+    def prune(cls, before):
+        """Removes the tombstones recorded before a time and returns how many there were"""
+        logger.info("Pruning tombstones older than %s", before)
+        count = db.session.execute(delete(cls).where(cls.deleted_at < before)).rowcount
+        db.session.commit()
+        return count
+
+
+class InventoryOutbox(db.Model):
+    """
+    Class that holds the change events committed with the writes that made
+    them until the relay has sent them to every worker
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Inventory outbox event: id={self.id}>"
+
+    @classmethod
+    def record(cls, payloads):
+        """Adds events to the outbox in the current transaction"""
+        if payloads:
+            db.session.execute(insert(cls), [{"payload": payload} for payload in payloads])
+
+    @classmethod
+    def claim(cls, limit):
+        """
+        Removes the oldest events from the outbox without committing
+
+        Rows locked by the relay of another worker are skipped, so every
+        event is sent once even when all the workers relay
+
+        Returns:
+            list: the payloads of up to limit events, oldest first
+        """
+        rows = db.session.execute(cls.claim_statement(limit)).all()
+        return [payload for _, payload in sorted(rows)]
+
+    @classmethod
+    def claim_statement(cls, limit):
+        """Returns the DELETE that claims the oldest events, returning their ids and payloads"""
+        oldest = select(cls.id).order_by(cls.id).limit(limit).with_for_update(skip_locked=True)
+        return (
+            delete(cls)
+            .where(cls.id.in_(oldest))
+            .returning(cls.id, cls.payload)
+            .execution_options(synchronize_session=False)
+        )
@@ -5,33 +5,140 @@ Service is used to manage products in the inventory.
 """
 
 # pylint: disable=cyclic-import, import-error
-from flask import abort
+import json
+import math
+import hashlib
+from flask import Blueprint, abort, current_app, request, Response, stream_with_context
 from flask_restx import Resource, fields, reqparse
+from werkzeug.http import quote_etag
 from service.common import status  # HTTP Status Codes
-from service.models import Inventory, Condition
+from service.models import (
+    Inventory, InventoryTombstone, Condition, DataValidationError, db, cache, events, relay
+)
+from service.common.pool import pool_stats
+from service.common.metrics import registry, CONTENT_TYPE
+from service.common.health import probe
+from service.common.events import TooManySubscribers
+from service.common.replicas import replicas, COOKIE, READ_ONLY_METHODS
+from service.common.pagination import (
+    encode_cursor, decode_id_cursor, encode_watermark, decode_watermark
+)
+
+# Import the Swagger Api of the app
+from . import api
 
-# Import Flask application
-from . import app, api
+# The routes outside of the Api, registered on the app by create_app
+blueprint = Blueprint("service", __name__)
 
 
 ############################################################
 # Health Endpoint
 ############################################################
-@app.route("/health", methods=["GET"])
+@blueprint.route("/health", methods=["GET"])
 def health():
     """Health Status"""
-    app.logger.info("Request to check health of Kubernetes cluster")
+    current_app.logger.info("Request to check health of Kubernetes cluster")
     return {"status": 'OK'}, status.HTTP_200_OK
 
 
+@blueprint.route("/health/live", methods=["GET"])
+def liveness():
+    """Liveness: the process answers requests, the database is not checked"""
+    return {"status": 'OK'}, status.HTTP_200_OK
+
+
+@blueprint.route("/health/ready", methods=["GET"])
+def readiness():
+    """Readiness: the cached result of the database and connection pool checks"""
+    result = probe.status()
+    if not result["ready"]:
+        current_app.logger.warning("Not ready: %s", ", ".join(result["reasons"]))
+        return result, status.HTTP_503_SERVICE_UNAVAILABLE
+    return result, status.HTTP_200_OK
+
+
+############################################################
+# Stats Endpoint
+############################################################
+@blueprint.route("/stats", methods=["GET"])
+def stats():
+    """Counters for monitoring the service"""
+    return {
+        "cache": cache.stats(),
+        "events": events.stats(),
+        "outbox": relay.stats(),
+        "pool": pool_stats(db.engine),
+        "replicas": replicas.stats(),
+    }, status.HTTP_200_OK
+
+
+############################################################
+# Metrics Endpoint
+############################################################
+@blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    """Request, database and pool metrics in the Prometheus text format"""
+    return Response(registry.render(), mimetype=CONTENT_TYPE)
+
+
+def pool_value(name):
+    """Returns a function reading one value of the connection pool state"""
+    return lambda: pool_stats(db.engine).get(name, 0)
+
+
+registry.function("db_pool_checked_out", "gauge", "Connections in use",
+                  pool_value("checked_out"))
+registry.function("db_pool_overflow", "gauge", "Connections opened beyond the pool size",
+                  pool_value("overflow"))
+registry.function("db_pool_waiting", "gauge", "Requests waiting for a connection",
+                  pool_value("waiting"))
+registry.function("db_pool_timeouts_total", "counter", "Waits for a connection that timed out",
+                  pool_value("timeouts"))
+registry.function("db_replica_reads_total", "counter", "GET requests that read from a replica",
+                  lambda: replicas.stats()["reads"]["replica"])
+registry.function("db_replica_fallbacks_total", "counter",
+                  "GET requests that read from the primary with replicas configured",
+                  lambda: replicas.stats()["reads"]["primary"])
+
+
+############################################################
+# Start the outbox relay, the readiness checks and the replica
+# checks with the first request, so CLI commands do not run them
+############################################################
+@blueprint.before_app_request
+def start_background_threads():
+    """Starts the outbox relay, the readiness checks and the replica checks of this worker once"""
+    relay.start()
+    probe.start()
+    replicas.start()
+
+
+############################################################
+# Send the reads of GET requests to an up to date replica,
+# and keep the reads of a client that wrote on the primary
+############################################################
+@blueprint.before_app_request
+def route_reads():
+    """Chooses the database that the reads of this request use"""
+    replicas.route(request.method in READ_ONLY_METHODS, request.cookies.get(COOKIE))
+
+
+@blueprint.after_app_request
+def remember_writes(response):
+    """Tells the client of a write to read from the primary until the replicas have it"""
+    if request.method not in READ_ONLY_METHODS + ("OPTIONS",):
+        replicas.remember_write(response)
+    return response
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
+@blueprint.route("/")
 def index():
     """ Root URL response """
-    app.logger.info("Request for Root URL")
-    return app.send_static_file("index.html")
+    current_app.logger.info("Request for Root URL")
+    return current_app.send_static_file("index.html")
 
 
 # Define the model so that the docs reflect what can be sent
@@ -56,6 +163,56 @@ inventory_model = api.inherit(
     }
 )
 
+adjust_model = api.model('Adjustment', {
+    'delta': fields.Integer(required=True,
+                            description='The signed amount to add to the quantity'),
+    'floor_at_zero': fields.Boolean(
+        default=False, description='Reject adjustments that make the quantity negative'),
+})
+
+bulk_error_model = api.model('BulkError', {
+    'index': fields.Integer(description='The position of the rejected item in the request'),
+    'message': fields.String(description='Why the item was rejected'),
+})
+
+bulk_create_model = api.model('BulkCreateResult', {
+    'created': fields.Integer(description='The number of inventory items created'),
+    'ids': fields.List(fields.Integer, description='The ids of the created inventory items'),
+    'errors': fields.List(fields.Nested(bulk_error_model),
+                          description='The items that were rejected'),
+})
+
+bulk_update_model = api.model('BulkUpdateResult', {
+    'updated': fields.Integer(description='The number of inventory items updated'),
+    'ids': fields.List(fields.Integer, description='The ids of the updated inventory items'),
+})
+
+bulk_delete_model = api.model('BulkDeleteResult', {
+    'deleted': fields.Integer(description='The number of inventory items deleted'),
+    'ids': fields.List(fields.Integer, description='The ids of the deleted inventory items'),
+})
+
+report_totals_model = api.model('RestockTotals', {
+    'items': fields.Integer(description='The number of inventory items to restock'),
+    'shortfall': fields.Integer(description='The sum of restock_level - quantity of these items'),
+})
+
+report_item_model = api.inherit('RestockItem', inventory_model, {
+    'shortfall': fields.Integer(description='The restock level minus the quantity'),
+})
+
+restock_report_model = api.model('RestockReport', {
+    'generated_at': fields.String(description='When the report was computed, in UTC'),
+    'items': fields.Integer(description='The number of inventory items to restock'),
+    'shortfall': fields.Integer(description='The total restock_level - quantity of these items'),
+    'by_condition': fields.Raw(description='The items and shortfall of each condition'),
+    'most_depleted': fields.List(fields.Nested(report_item_model),
+                                 description='The items with the largest shortfall first'),
+})
+
+NDJSON = 'application/x-ndjson'
+EVENT_STREAM = 'text/event-stream'
+
 # query string arguments
 inventory_args = reqparse.RequestParser()
 inventory_args.add_argument('name', type=str, location='args', required=False,
@@ -67,6 +224,124 @@ inventory_args.add_argument('restock', type=str, location='args', required=False
                             '\nAccepted values are true/True/false/False')
 inventory_args.add_argument('quantity', type=str, location='args', required=False,
                             help='List Inventory Items by Quantity')
+inventory_args.add_argument('quantity_min', type=str, location='args', required=False,
+                            help='List Inventory Items with at least this Quantity')
+inventory_args.add_argument('quantity_max', type=str, location='args', required=False,
+                            help='List Inventory Items with at most this Quantity')
+inventory_args.add_argument('name_prefix', type=str, location='args', required=False,
+                            help='List Inventory Items whose Name starts with this prefix')
+inventory_args.add_argument('fields', type=str, action='split', location='args', required=False,
+                            help='A comma separated list of the fields to return')
+inventory_args.add_argument('format', type=str, location='args', required=False,
+                            choices=('rows', 'columnar'), default='rows',
+                            help='Return a list of items (rows) or one list per field (columnar)')
+inventory_args.add_argument('limit', type=int, location='args', required=False,
+                            help='The maximum number of Inventory Items to return in one page')
+inventory_args.add_argument('cursor', type=str, location='args', required=False,
+                            help='The opaque cursor from the Link header of the previous page')
+
+
+def next_page_link(last_id):
+    """Builds the Link header that points at the page after last_id"""
+    params = request.args.to_dict()
+    params["cursor"] = encode_cursor(last_id)
+    url = api.url_for(InventoryCollection, _external=True, **params)
+    return f'<{url}>; rel="next"'
+
+
+def filtered_query(args, cursor=None, limit=None):
+    """Returns the query combining every filter given in args, or None without filters"""
+    filters = {key: args[key] for key in Inventory.FILTERS if args[key]}
+    if not filters:
+        return None
+    return Inventory.find_by_filters(filters, cursor, limit)
+
+
+def check_if_match(inventory_id):
+    """
+    Honours the If-Match header of a write to an Inventory item
+
+    The item is read with its row locked so it cannot change before the
+    write commits. Aborts with 412 if it no longer has the given ETag
+
+    Returns:
+        Inventory: the locked item, or None without If-Match or when it does not exist
+    """
+    if not request.if_match:
+        return None
+    item = Inventory.find_for_update(inventory_id)
+    if item and not request.if_match.contains(item.etag):
+        abort(status.HTTP_412_PRECONDITION_FAILED,
+              f"Item with inventory_id: {inventory_id} was changed by another request")
+    return item
+
+
+def collection_etag(rows):
+    """Returns the ETag of a list response from its query and the version of the rows it lists"""
+    version = f"{request.query_string.decode()}|{Inventory.rows_version(rows)}"
+    return hashlib.sha1(version.encode("utf-8")).hexdigest()
+
+
+def bulk_payload():
+    """Yields the items of a bulk request sent as a JSON array or as NDJSON"""
+    if request.mimetype == NDJSON:
+        for line in request.stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None  # rejected by Inventory.deserialize
+        return
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise DataValidationError("Bulk request body must be a JSON array or NDJSON")
+    yield from data
+
+
+# query string arguments of the bulk update and delete endpoints
+bulk_args = inventory_args.copy()
+bulk_args.remove_argument('limit')
+bulk_args.remove_argument('cursor')
+bulk_args.remove_argument('fields')
+bulk_args.remove_argument('format')
+bulk_args.add_argument('ids', type=int, action='split', location='args', required=False,
+                       help='A comma separated list of Inventory Item ids')
+
+
+# query string arguments of the change feed
+changes_args = reqparse.RequestParser()
+changes_args.add_argument('since', type=str, location='args', required=True,
+                          help='An ISO 8601 timestamp or the next token of the previous response')
+changes_args.add_argument('limit', type=int, location='args', required=False,
+                          help='The maximum number of changed Inventory Items to return')
+
+
+# query string arguments of the event stream
+events_args = reqparse.RequestParser()
+events_args.add_argument('types', type=str, action='split', location='args', required=False,
+                         help='A comma separated list of the event types to receive'
+                         '\nAccepted values are create/update/delete/restock')
+events_args.add_argument('last_event_id', type=str, location='args', required=False,
+                         help='Resume after this event id instead of the Last-Event-ID header')
+
+EVENT_TYPES = ('create', 'update', 'delete', 'restock')
+
+
+# query string arguments of the restock report
+report_args = reqparse.RequestParser()
+report_args.add_argument('top', type=int, location='args', required=False, default=10,
+                         help='The number of most depleted Inventory Items to list')
+
+
+def bulk_query(args):
+    """Returns the query selecting the items of a bulk update or delete"""
+    if args["ids"]:
+        return Inventory.find_by_ids(args["ids"])
+    query = filtered_query(args)
+    if query is None:
+        raise DataValidationError("Bulk request needs ids or at least one filter")
+    return query
+
 
 ######################################################################
 #  R E S T   A P I   E N D P O I N T S
@@ -92,21 +367,25 @@ class InventoryResource(Resource):
     # RETRIEVE AN INVENTORY ITEM
     ######################################################################
     @api.doc('get_inventory_items')
+    @api.response(200, 'Success', inventory_model)
+    @api.response(304, 'Inventory Item not modified since the ETag in If-None-Match')
     @api.response(404, 'Inventory Item not found')
-    @api.marshal_with(inventory_model)
     def get(self, inventory_id):
         """
         Retrieve a single Inventory
 
         This endpoint will return an Inventory item based on it's id
         """
-        app.logger.info("Request for item with id: %s", inventory_id)
+        current_app.logger.info("Request for item with id: %s", inventory_id)
         inventory = Inventory.find(inventory_id)
         if not inventory:
             abort(status.HTTP_404_NOT_FOUND, f"Inventory with id '{inventory_id}' was not found.")
 
-        app.logger.info("Returning item: %s", inventory.name)
-        return inventory.serialize(), status.HTTP_200_OK
+        headers = {"ETag": quote_etag(inventory.etag)}
+        if request.if_none_match.contains(inventory.etag):
+            return "", status.HTTP_304_NOT_MODIFIED, headers
+        current_app.logger.info("Returning item: %s", inventory.name)
+        return inventory.serialize(), status.HTTP_200_OK, headers
 
     ######################################################################
     #  UPDATE AN INVENTORY ITEM
@@ -115,8 +394,9 @@ class InventoryResource(Resource):
     @api.doc('update_inventory_items')
     @api.response(404, 'Inventory item not found')
     @api.response(400, 'The posted Item data was not valid')
+    @api.response(412, 'Inventory item changed since the ETag in If-Match')
     @api.expect(inventory_model)
-    @api.marshal_with(inventory_model)
+    @api.response(200, 'Success', inventory_model)
     def put(self, inventory_id):
         """
         Updating an inventory item
@@ -124,14 +404,16 @@ class InventoryResource(Resource):
         This endpoint will update an item based on the data in the body that is posted
         """
 
-        app.logger.info("Request to update an inventory item with inventory_id:%s", inventory_id)
-        item = Inventory.find(inventory_id)
+        current_app.logger.info(
+            "Request to update an inventory item with inventory_id:%s", inventory_id
+        )
+        item = check_if_match(inventory_id) or Inventory.find(inventory_id, cached=False)
         if not item:
             abort(status.HTTP_404_NOT_FOUND, f"Item with inventory_id: {inventory_id} not found")
         item.deserialize(api.payload)
-        item.id = inventory_id
+        item.id = Inventory.validate_id(inventory_id)
         item.update()
-        return item.serialize(), status.HTTP_200_OK
+        return item.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(item.etag)}
 
     ######################################################################
     # DELETE AN INVENTORY ITEM
@@ -145,13 +427,13 @@ class InventoryResource(Resource):
 
         This endpoint will delete an inventory item based the id specified in the path
         """
-        app.logger.info("Request to delete inventory with id: %s", inventory_id)
-        inventory = Inventory.find(inventory_id)
+        current_app.logger.info("Request to delete inventory with id: %s", inventory_id)
+        inventory = Inventory.find(inventory_id, cached=False)
         if inventory:
             inventory.delete()
-            app.logger.info("Inventory with ID [%s] delete complete.", inventory_id)
+            current_app.logger.info("Inventory with ID [%s] delete complete.", inventory_id)
         else:
-            app.logger.info("Inventory with ID [%s] does not exist", inventory_id)
+            current_app.logger.info("Inventory with ID [%s] does not exist", inventory_id)
 
         return '', status.HTTP_204_NO_CONTENT
 
@@ -168,18 +450,20 @@ class InventoryCollection(Resource):
     @api.doc('create_inventory')
     @api.response(400, 'The posted data was not valid')
     @api.expect(create_model)
-    @api.marshal_with(inventory_model, code=201)
+    @api.response(201, 'Inventory item created', inventory_model)
     def post(self):
         """
         Creates an inventory item
         This endpoint will create an item based on the data in the body that is posted
         """
-        app.logger.info("Request to create an inventory item")
+        current_app.logger.info("Request to create an inventory item")
         item = Inventory()
         item.deserialize(api.payload)
         item.create()
         location_url = api.url_for(InventoryResource, inventory_id=item.id, _external=True)
-        app.logger.info("Inventory item named [%s] with ID [%s] created.", item.name, item.id)
+        current_app.logger.info(
+            "Inventory item named [%s] with ID [%s] created.", item.name, item.id
+        )
         return item.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
 
     ######################################################################
@@ -187,33 +471,308 @@ class InventoryCollection(Resource):
     ######################################################################
     @api.doc('list_inventory_items')
     @api.expect(inventory_args, validate=True)
-    @api.marshal_list_with(inventory_model)
+    @api.response(200, 'Success', [inventory_model])
+    @api.response(304, 'No Inventory Item changed since the ETag in If-None-Match')
     def get(self):
         """
         List all inventory items
 
         This endpoint will list all inventory items in the database
+        matching every one of the given filters
+        When a limit is given the next page is linked to in the Link header
+        Only the columns named in fields are read and returned, and the
+        columnar format returns one list of values per field
         """
-        app.logger.info("Request to list all inventory items")
-        items = []
+        current_app.logger.info("Request to list all inventory items")
         args = inventory_args.parse_args()
-        condition = args["condition"]
-        restock = args["restock"]
-        quantity = args["quantity"]
-        name = args["name"]
-        if condition:
-            items = Inventory.find_by_condition(condition)
-        elif restock:
-            items = Inventory.find_by_restock_level(restock)
-        elif quantity:
-            items = Inventory.find_by_quantity(quantity)
-        elif name:
-            items = Inventory.find_by_name(name)
+        limit = args["limit"]
+        cursor = decode_id_cursor(args["cursor"]) if args["cursor"] else None
+        items = filtered_query(args, cursor, limit)
+        if items is None:
+            items = Inventory.find_by_filters({}, cursor, limit)
+        # plain rows serialized by a precompiled function cost much less than Inventory items,
+        # the update time last in each row is only read for the ETag
+        selected = args["fields"]
+        rows = Inventory.select_fields(items, selected or Inventory.FIELDS) \
+            .add_columns(Inventory.updated_at).all()
+        etag = collection_etag(rows)
+        if request.if_none_match.contains(etag):
+            return "", status.HTTP_304_NOT_MODIFIED, {"ETag": quote_etag(etag)}
+        results = list(map(Inventory.row_serializer(selected or Inventory.FIELDS), rows))
+        current_app.logger.info("Returning %d inventory items", len(results))
+        headers = {"ETag": quote_etag(etag)}
+        if limit and len(rows) == limit:
+            headers["Link"] = next_page_link(rows[-1].id)
+        if args["format"] == "columnar":
+            results = {
+                field: [result[field] for result in results]
+                for field in selected or Inventory.FIELDS
+            }
+        return results, status.HTTP_200_OK, headers
+
+######################################################################
+#  PATH: /inventory/bulk
+######################################################################
+
+
+@api.route('/inventory/bulk')
+class InventoryBulk(Resource):
+    """ Handles operations on many Inventory items at once """
+    ######################################################################
+    # ADD MANY INVENTORY ITEMS
+    ######################################################################
+    @api.doc('create_inventory_items')
+    @api.response(400, 'None of the posted items were valid')
+    @api.expect([create_model])
+    @api.marshal_with(bulk_create_model, code=201)
+    def post(self):
+        """
+        Creates many inventory items
+
+        This endpoint accepts a JSON array or an NDJSON stream of items.
+        Valid items are inserted and committed in chunks, invalid ones are
+        reported by their index in the request
+        """
+        current_app.logger.info("Request to create inventory items in bulk")
+        chunk_size = current_app.config["BULK_CHUNK_SIZE"]
+        ids, errors, chunk = [], [], []
+        for position, data in enumerate(bulk_payload()):
+            try:
+                chunk.append(Inventory().deserialize(data))
+            except DataValidationError as error:
+                errors.append({"index": position, "message": str(error)})
+                continue
+            if len(chunk) >= chunk_size:
+                ids.extend(Inventory.create_many(chunk))
+                chunk = []
+        if chunk:
+            ids.extend(Inventory.create_many(chunk))
+        current_app.logger.info("Created %d inventory items, rejected %d", len(ids), len(errors))
+        code = status.HTTP_400_BAD_REQUEST if errors and not ids else status.HTTP_201_CREATED
+        return {"created": len(ids), "ids": ids, "errors": errors}, code
+
+    ######################################################################
+    # UPDATE MANY INVENTORY ITEMS
+    ######################################################################
+    @api.doc('update_inventory_items_in_bulk')
+    @api.response(400, 'The posted changes were not valid')
+    @api.expect(bulk_args, validate=True)
+    @api.marshal_with(bulk_update_model)
+    def patch(self):
+        """
+        Updates many inventory items
+
+        A JSON array of partial items, each with its id, is applied by primary key.
+        A single partial item is applied to every item selected by the ids or
+        filter query string arguments with one UPDATE statement
+        """
+        current_app.logger.info("Request to update inventory items in bulk")
+        data = request.get_json(silent=True)
+        if isinstance(data, list):
+            ids = Inventory.update_many([Inventory.deserialize_changes(item) for item in data])
         else:
-            items = Inventory.all()
-        results = [item.serialize() for item in items]
-        app.logger.info("Returning %d inventory items", len(results))
-        return results, status.HTTP_200_OK
+            changes = Inventory.deserialize_changes(data, with_id=False)
+            ids = Inventory.update_matching(bulk_query(bulk_args.parse_args()), changes)
+        current_app.logger.info("Updated %d inventory items", len(ids))
+        return {"updated": len(ids), "ids": ids}, status.HTTP_200_OK
+
+    ######################################################################
+    # DELETE MANY INVENTORY ITEMS
+    ######################################################################
+    @api.doc('delete_inventory_items_in_bulk')
+    @api.response(400, 'Neither ids nor a filter were given')
+    @api.expect(bulk_args, validate=True)
+    @api.marshal_with(bulk_delete_model)
+    def delete(self):
+        """
+        Deletes many inventory items
+
+        This endpoint deletes every item selected by the ids or filter
+        query string arguments with one DELETE statement
+        """
+        current_app.logger.info("Request to delete inventory items in bulk")
+        ids = Inventory.delete_many(bulk_query(bulk_args.parse_args()))
+        current_app.logger.info("Deleted %d inventory items", len(ids))
+        return {"deleted": len(ids), "ids": ids}, status.HTTP_200_OK
+
+######################################################################
+#  PATH: /inventory/export
+######################################################################
+
+
+@api.route('/inventory/export')
+class InventoryExport(Resource):
+    """ Streams the whole Inventory as newline delimited JSON """
+    ######################################################################
+    # EXPORT ALL INVENTORY ITEMS
+    ######################################################################
+    @api.doc('export_inventory_items')
+    @api.produces(['application/x-ndjson'])
+    @api.response(200, 'One serialized Inventory item per line')
+    @api.response(406, 'The client does not accept application/x-ndjson')
+    def get(self):
+        """
+        Export all inventory items
+
+        This endpoint streams every inventory item in the database ordered by id,
+        reading the table in batches so memory use does not grow with its size
+        """
+        current_app.logger.info("Request to export all inventory items")
+        if request.accept_mimetypes and not request.accept_mimetypes.best_match([NDJSON]):
+            abort(status.HTTP_406_NOT_ACCEPTABLE, f"Export is only available as {NDJSON}")
+        batch_size = current_app.config["EXPORT_BATCH_SIZE"]
+
+        def generate():
+            for item in Inventory.iter_all(batch_size):
+                yield json.dumps(item.serialize()) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+
+######################################################################
+#  PATH: /inventory/changes
+######################################################################
+@api.route('/inventory/changes')
+class InventoryChanges(Resource):
+    """ Returns the Inventory items written and deleted since a watermark """
+    ######################################################################
+    # LIST CHANGES SINCE A WATERMARK
+    ######################################################################
+    @api.doc('list_inventory_changes')
+    @api.expect(changes_args, validate=True)
+    @api.response(200, 'The changed and deleted Inventory items')
+    @api.response(400, 'The since parameter is missing or invalid')
+    def get(self):
+        """
+        List the changes made since a watermark
+
+        This endpoint returns the items created or updated after `since`, oldest
+        first, and the ids of the items deleted after it, at most `limit` of them
+        together. Pass the returned `next` token as `since` on the following
+        request to continue from where this response stopped. A Link header is
+        set while more changes are waiting
+        """
+        args = changes_args.parse_args()
+        current_app.logger.info("Request to list changes since %s", args["since"])
+        since, after_id = decode_watermark(args["since"])
+        limit = args["limit"]
+        if limit is None:
+            limit = current_app.config["CHANGES_PAGE_SIZE"]
+        if limit < 1:
+            raise DataValidationError("limit must be a positive integer")
+
+        items = Inventory.find_changes(since, after_id, limit)
+        tombstones = InventoryTombstone.find_since(since, after_id, limit)
+        # the page holds the oldest writes and deletions, so the watermark never skips one
+        changes = sorted(
+            [(item.updated_at, item.id, item) for item in items]
+            + [(tombstone.deleted_at, tombstone.inventory_id, None) for tombstone in tombstones],
+            key=lambda change: change[:2],
+        )
+        full_page = limit in (len(items), len(tombstones)) or len(changes) > limit
+        changes = changes[:limit]
+        watermark = changes[-1][:2] if changes else (since, after_id)
+
+        next_token = encode_watermark(*watermark)
+        headers = {}
+        if full_page:
+            params = request.args.to_dict()
+            params["since"] = next_token
+            url = api.url_for(InventoryChanges, _external=True, **params)
+            headers["Link"] = f'<{url}>; rel="next"'
+        body = {
+            "changes": [item.serialize() for _, _, item in changes if item is not None],
+            "deleted": sorted(by_id for _, by_id, item in changes if item is None),
+            "next": next_token,
+        }
+        return body, status.HTTP_200_OK, headers
+
+
+######################################################################
+#  PATH: /inventory/reports/restock
+######################################################################
+@api.route('/inventory/reports/restock')
+class RestockReport(Resource):
+    """ Summarizes the Inventory items below their restock level """
+    ######################################################################
+    # REPORT THE ITEMS TO RESTOCK
+    ######################################################################
+    @api.doc('restock_report')
+    @api.expect(report_args, validate=True)
+    @api.response(400, 'The top parameter is invalid')
+    @api.marshal_with(restock_report_model)
+    def get(self):
+        """
+        Report the items to restock
+
+        This endpoint returns the number of items at or below their restock
+        level and their total shortfall, overall and per condition, with the
+        `top` items that are the furthest below it. The report is computed by
+        the database and may be up to REPORT_CACHE_TTL seconds old
+        """
+        top = report_args.parse_args()["top"]
+        current_app.logger.info("Request for the restock report of the top %s items", top)
+        if top is None or not 0 < top <= current_app.config["REPORT_TOP_MAX"]:
+            raise DataValidationError(
+                f"top must be between 1 and {current_app.config['REPORT_TOP_MAX']}"
+            )
+        return Inventory.restock_report(top), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /inventory/events
+######################################################################
+@api.route('/inventory/events')
+class InventoryEvents(Resource):
+    """ Streams the changes made to Inventory items as Server-Sent Events """
+    ######################################################################
+    # SUBSCRIBE TO CHANGE EVENTS
+    ######################################################################
+    @api.doc('stream_inventory_events')
+    @api.expect(events_args, validate=True)
+    @api.produces([EVENT_STREAM])
+    @api.response(200, 'One event per create, update, delete or restock')
+    @api.response(400, 'The event types are invalid')
+    @api.response(503, 'The worker already streams to EVENTS_MAX_SUBSCRIBERS clients')
+    def get(self):
+        """
+        Subscribe to change events
+
+        This endpoint keeps the connection open and sends an event each time an
+        inventory item is created, updated, deleted or restocked. Reconnecting
+        with the Last-Event-ID header replays the events that were missed; a
+        `reset` event means they are gone and the client should resync with
+        GET /inventory/changes. Each stream holds a worker thread, so a worker
+        with EVENTS_MAX_SUBSCRIBERS streams open answers 503 with Retry-After
+        """
+        args = events_args.parse_args()
+        types = args["types"] or []
+        for event_type in types:
+            if event_type not in EVENT_TYPES:
+                raise DataValidationError("Invalid event type: " + event_type)
+        last_event_id = request.headers.get("Last-Event-ID", args["last_event_id"])
+        current_app.logger.info("Request to subscribe to events after %s", last_event_id)
+        keepalive = current_app.config["EVENTS_KEEPALIVE"]
+        try:
+            subscription = events.subscribe(last_event_id, types)
+        except TooManySubscribers as error:
+            current_app.logger.warning(str(error))
+            return {"message": str(error)}, status.HTTP_503_SERVICE_UNAVAILABLE, \
+                {"Retry-After": str(math.ceil(keepalive))}
+
+        def generate():
+            try:
+                yield f"retry: {int(keepalive * 1000)}\n\n"
+                if subscription.missed:
+                    yield 'event: reset\ndata: {"resync": "/api/inventory/changes"}\n\n'
+                for event in subscription.events(keepalive):
+                    yield ": keep-alive\n\n" if event is None else event.to_sse()
+            finally:
+                events.unsubscribe(subscription)
+
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return Response(generate(), mimetype=EVENT_STREAM, headers=headers)
+
 
 ######################################################################
 #  PATH: /inventory/{inventory_id}/restock
@@ -230,7 +789,8 @@ class RestockResource(Resource):
     @api.doc('restock_item')
     @api.response(404, 'Inventory Item not found')
     @api.response(409, 'The item quantity is above restock level')
-    @api.marshal_with(inventory_model)
+    @api.response(412, 'Inventory item changed since the ETag in If-Match')
+    @api.response(200, 'Success', inventory_model)
     def put(self, inventory_id):
         """
         Restock an existing inventory item
@@ -238,19 +798,60 @@ class RestockResource(Resource):
         This is an Action as URL that will restock an existing
         inventory item in the database
         """
-        app.logger.info("Request to restock an inventory item with inventory_id:%s", inventory_id)
-        item = Inventory.find(inventory_id)
+        current_app.logger.info(
+            "Request to restock an inventory item with inventory_id:%s", inventory_id
+        )
+        check_if_match(inventory_id)
+        item = Inventory.restock(inventory_id)
         if not item:
-            abort(status.HTTP_404_NOT_FOUND,
-                  f"Item with inventory_id: {inventory_id} was not found")
-        if item.quantity > item.restock_level:
+            # only look the item up to explain why nothing was restocked
+            if not Inventory.find(inventory_id, cached=False):
+                abort(status.HTTP_404_NOT_FOUND,
+                      f"Item with inventory_id: {inventory_id} was not found")
             abort(
                 status.HTTP_409_CONFLICT,
                 f"Item with inventory_id: {inventory_id} is already above the restock level"
             )
-        else:
-            item.quantity = item.restock_level + 1
-            item.id = inventory_id
-            item.update()
+
+        return item.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(item.etag)}
+
+
+######################################################################
+#  PATH: /inventory/{inventory_id}/adjust
+######################################################################
+@api.route('/inventory/<inventory_id>/adjust')
+@api.param('inventory_id', 'The Inventory Item identifier')
+class AdjustResource(Resource):
+    """ Adjust Action on the quantity of an Inventory Item"""
+    ######################################################################
+    # ADJUST THE QUANTITY OF AN INVENTORY ITEM
+    ######################################################################
+    @api.doc('adjust_item')
+    @api.response(404, 'Inventory Item not found')
+    @api.response(400, 'The posted adjustment was not valid')
+    @api.response(409, 'The adjustment would make the quantity negative')
+    @api.expect(adjust_model)
+    @api.response(200, 'Success', inventory_model)
+    def post(self, inventory_id):
+        """
+        Adjust the quantity of an existing inventory item
+
+        This is an Action as URL that adds a signed delta to the quantity
+        of an inventory item in a single atomic UPDATE
+        """
+        current_app.logger.info(
+            "Request to adjust an inventory item with inventory_id:%s", inventory_id
+        )
+        delta, floor_at_zero = Inventory.validate_adjustment(api.payload)
+        item = Inventory.adjust_quantity(inventory_id, delta, floor_at_zero)
+        if not item:
+            if not Inventory.find(inventory_id, cached=False):
+                abort(status.HTTP_404_NOT_FOUND,
+                      f"Item with inventory_id: {inventory_id} was not found")
+            abort(
+                status.HTTP_409_CONFLICT,
+                f"Adjusting item with inventory_id: {inventory_id} by {delta} "
+                "would make its quantity negative"
+            )
 
         return item.serialize(), status.HTTP_200_OK
@@ -0,0 +1,22 @@
+"""
+Database helpers shared by the test cases and the benchmarks
+
+The app leaves making its tables to flask db-migrate, so the tests and the
+benchmarks make them here
+"""
+from service.models import db, Inventory, InventoryTombstone, InventoryOutbox, cache, events
+
+
+def create_tables(app):
+    """Makes the tables of the app's database"""
+    with app.app_context():
+        db.create_all()
+
+
+def empty_tables():
+    """Removes the rows, cached items and events of the last test, in the current app context"""
+    for model in (Inventory, InventoryTombstone, InventoryOutbox):
+        db.session.query(model).delete()
+    db.session.commit()
+    cache.clear()
+    events.clear()
@@ -0,0 +1,72 @@
+"""
+Test cases for building the app and the gunicorn hooks
+"""
+import os
+import runpy
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from flask import Flask
+import service
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+######################################################################
+#  A P P   T E S T   C A S E S
+######################################################################
+class TestApp(TestCase):
+    """App Factory Tests"""
+
+    def test_lazy_app(self):
+        """It should build service:app once, when it is first used"""
+        app = service.app
+        self.assertIsInstance(app, Flask)
+        self.assertIs(vars(service)["app"], app)
+        self.assertIs(service.app, app)
+        with self.assertRaises(AttributeError):
+            service.__getattr__("nothing")
+
+    def test_operation_ids(self):
+        """It should give every operation of the Swagger spec its own id"""
+        with service.app.test_request_context():
+            paths = service.api.__schema__["paths"]
+        ids = [operation["operationId"] for path in paths.values()
+               for operation in path.values() if isinstance(operation, dict) and "operationId" in operation]
+        self.assertIn("update_inventory_items_in_bulk", ids)
+        self.assertEqual(len(ids), len(set(ids)))
+
+    @patch("service.log_handlers.restart_queue")
+    @patch("service.models.db")
+    def test_reset_after_fork(self, db_mock, restart_queue_mock):
+        """It should forget the inherited connections without closing them, and restart the log queue"""
+        engine = MagicMock()
+        db_mock.engines = {None: engine}
+        service.reset_after_fork(Flask(__name__))
+        engine.dispose.assert_called_once_with(close=False)
+        restart_queue_mock.assert_called_once()
+
+    @patch("service.reset_after_fork")
+    def test_post_fork(self, reset_mock):
+        """It should only reset the workers forked from a master that preloaded the app"""
+        hooks = runpy.run_path(CONFIG_FILE)
+        server = MagicMock()
+        server.cfg.preload_app = False
+        hooks["post_fork"](server, MagicMock())
+        reset_mock.assert_not_called()
+        server.cfg.preload_app = True
+        hooks["post_fork"](server, MagicMock())
+        reset_mock.assert_called_once_with(service.app)
+
+    def test_server_modes(self):
+        """It should run the Flask app in threaded workers and the ASGI app in uvicorn workers"""
+        with patch.dict(os.environ, {"SERVER_MODE": "sync", "GUNICORN_THREADS": "8"}):
+            settings = runpy.run_path(CONFIG_FILE)
+        self.assertEqual(settings["wsgi_app"], "service:app")
+        self.assertEqual(settings["worker_class"], "gthread")
+        self.assertEqual(settings["threads"], 8)
+        with patch.dict(os.environ, {"SERVER_MODE": "async"}):
+            settings = runpy.run_path(CONFIG_FILE)
+        self.assertEqual(settings["wsgi_app"], "service.asgi:app")
+        self.assertNotIn("threads", settings)
+        with patch.dict(os.environ, {"SERVER_MODE": "eventlet"}):
+            self.assertRaises(ValueError, runpy.run_path, CONFIG_FILE)
@@ -0,0 +1,115 @@
+"""
+Test cases for the API benchmark
+"""
+import itertools
+import threading
+from unittest import TestCase
+from urllib.parse import parse_qs, urlsplit
+from service.common.pagination import decode_id_cursor
+from benchmarks import api as bench
+from benchmarks import serialization, startup
+
+
+class RecordingClient:  # pylint: disable=too-few-public-methods
+    """Stands in for the app, creating and listing the items of the bulk requests and recording the others"""
+
+    target = "recording"
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.items = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, method, path, body=None):
+        """Returns the status code and JSON body the app would"""
+        with self.lock:
+            self.requests.append((method, path, body))
+            if path.endswith("/bulk"):
+                created = [dict(item, id=next(self.ids)) for item in body]
+                self.items.update((item["id"], item) for item in created)
+                # the ids do not come back in the order of the items
+                return 201, {"ids": [item["id"] for item in reversed(created)]}
+            query = parse_qs(urlsplit(path).query)
+            if method == "GET" and "cursor" in query:
+                after = decode_id_cursor(query["cursor"][0])
+                listed = [self.items[item_id] for item_id in sorted(self.items) if item_id > after]
+                return 200, listed[:int(query["limit"][0])]
+        return (201 if method == "POST" else 200), {}
+
+
+######################################################################
+#  B E N C H M A R K   T E S T   C A S E S
+######################################################################
+class TestBenchmark(TestCase):
+    """API Benchmark Tests"""
+
+    def test_run(self):
+        """It should seed the items, then run every scenario at every concurrency level"""
+        options = bench.parse_args(["--items", "20", "--requests", "4", "--concurrency", "1,2",
+                                    "--warmup", "1"])
+        client = RecordingClient()
+        report = bench.run(client, options)
+        self.assertEqual(report["meta"]["target"], "recording")
+        self.assertEqual(len(report["results"]), 2 * len(bench.SCENARIOS))
+        for row in report["results"]:
+            self.assertEqual(row["requests"], 4, row["scenario"])
+            self.assertEqual(row["errors"], 0, row["scenario"])
+            self.assertLessEqual(row["latency_ms"]["p50"], row["latency_ms"]["p99"])
+        # 20 items, then an item without quantity for each restock and warm up request
+        self.assertEqual(len(client.requests[0][2]), 20)
+        self.assertEqual(len(client.requests[1][2]), 4 * 2 + 1)
+        self.assertTrue(all(item["quantity"] == 0 for item in client.requests[1][2]))
+        restocked = [path for method, path, _ in client.requests if path.endswith("/restock")]
+        self.assertEqual(len(set(restocked)), 9)
+        self.assertEqual({path.split("/")[-2] for path in restocked}, {str(item_id) for item_id in range(21, 30)})
+
+    def test_seed(self):
+        """It should pair each seeded item with its own id, whatever the order of the returned ids"""
+        client = RecordingClient()
+        items, restock_ids = bench.seed(client, 5, 2)
+        self.assertEqual(items, [client.items[item_id] for item_id in range(1, 6)])
+        self.assertEqual(sorted(restock_ids), [6, 7])
+
+    def test_percentile(self):
+        """It should return nearest rank percentiles"""
+        ordered = list(range(1, 101))
+        self.assertEqual(bench.percentile(ordered, 0.5), 50)
+        self.assertEqual(bench.percentile(ordered, 0.99), 99)
+        self.assertEqual(bench.percentile([7], 0.99), 7)
+        self.assertIsNone(bench.percentile([], 0.5))
+
+    def test_compare(self):
+        """It should report the scenarios slower than the baseline"""
+        def row(throughput, p99, errors=0):
+            return {"scenario": "get_item", "concurrency": 1, "throughput_rps": throughput,
+                    "latency_ms": {"p99": p99}, "errors": errors}
+        baseline = {"results": [row(100, 10)]}
+        self.assertEqual(bench.compare({"results": [row(90, 11)]}, baseline, 0.2), [])
+        regressions = bench.compare({"results": [row(70, 20, 1)]}, baseline, 0.2)
+        self.assertEqual(len(regressions), 3)
+        self.assertEqual(bench.compare({"results": [dict(row(1, 99), concurrency=4)]}, baseline, 0.2), [])
+
+    def test_unknown_scenario(self):
+        """It should refuse an unknown scenario"""
+        with self.assertRaises(SystemExit):
+            bench.parse_args(["--scenarios", "get_item,nothing"])
+
+    def test_serialization(self):
+        """It should time every serialization case and compare the paths before and after"""
+        report = serialization.run([10], repeat=1)
+        self.assertEqual(len(report["results"]), 7)
+        self.assertTrue(all(row["us_per_item"] > 0 for row in report["results"]))
+        comparisons = {row["path"]: row for row in report["comparisons"]}
+        self.assertEqual(comparisons["list response"]["after"], "list_rows")
+        self.assertGreater(comparisons["item response"]["speedup"], 0)
+
+    def test_startup_summary(self):
+        """It should report the min, median and max of every phase of the starts"""
+        runs = [{"import": 0.5, "create_app": 0.02, "ready": 0.6},
+                {"import": 0.7, "create_app": 0.04, "ready": 0.8},
+                {"import": 0.6, "create_app": 0.03, "ready": 0.7}]
+        phases = startup.summarize(runs)
+        self.assertEqual(list(phases), ["import", "create_app", "ready"])
+        self.assertEqual(phases["import"], {"min_ms": 500.0, "median_ms": 600.0, "max_ms": 700.0})
+        self.assertEqual(phases["create_app"]["median_ms"], 30.0)
@@ -0,0 +1,140 @@
+"""
+Test cases for the Item Cache
+
+"""
+import sys
+import fnmatch
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from service.common.cache import ItemCache, LRUCache, NullCache, RedisCache
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+    """A clock the tests can move forward"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Stands in for a Redis client with the commands used by RedisCache"""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    def get(self, name):
+        """Returns the stored bytes"""
+        return self.data.get(name)
+
+    def set(self, name, value, ex=None):
+        """Stores a value as bytes"""
+        self.data[name] = value.encode("utf-8")
+        self.expiry[name] = ex
+
+    def delete(self, name):
+        """Removes a value"""
+        self.data.pop(name, None)
+
+    def scan_iter(self, match="*"):
+        """Iterates over the matching names"""
+        return [name for name in list(self.data) if fnmatch.fnmatch(name, match)]
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestItemCache(TestCase):
+    """ Test Cases for the Item Cache """
+
+    def test_lru_get_and_set(self):
+        """It should return what was stored in the LRU cache"""
+        lru = LRUCache(maxsize=2, ttl=10)
+        self.assertIsNone(lru.get(1))
+        lru.set(1, {"id": 1})
+        self.assertEqual(lru.get(1), {"id": 1})
+        lru.delete(1)
+        self.assertIsNone(lru.get(1))
+
+    def test_lru_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        lru = LRUCache(maxsize=2, ttl=10)
+        lru.set(1, "one")
+        lru.set(2, "two")
+        lru.get(1)
+        lru.set(3, "three")
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.get(1), "one")
+        self.assertIsNone(lru.get(2))
+        self.assertEqual(lru.get(3), "three")
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+    def test_lru_expires_entries(self):
+        """It should expire entries after the TTL"""
+        clock = FakeClock()
+        lru = LRUCache(maxsize=2, ttl=5, clock=clock)
+        lru.set(1, "one")
+        clock.now = 4.9
+        self.assertEqual(lru.get(1), "one")
+        clock.now = 5.0
+        self.assertIsNone(lru.get(1))
+        self.assertEqual(len(lru), 0)
+
+    def test_redis_cache(self):
+        """It should store JSON values in a Redis protocol server"""
+        client = FakeRedis()
+        redis_cache = RedisCache(client, ttl=7, prefix="test:")
+        redis_cache.set(1, {"id": 1, "name": "shoe"})
+        self.assertEqual(client.expiry["test:1"], 7)
+        self.assertEqual(redis_cache.get(1), {"id": 1, "name": "shoe"})
+        redis_cache.delete(1)
+        self.assertIsNone(redis_cache.get(1))
+        redis_cache.set(2, {"id": 2})
+        client.set("other:2", "{}")
+        redis_cache.clear()
+        self.assertEqual(list(client.data), ["other:2"])
+
+    def test_null_cache(self):
+        """It should never return anything from the null cache"""
+        null = NullCache()
+        null.set(1, "one")
+        self.assertIsNone(null.get(1))
+
+    def test_item_cache_stats(self):
+        """It should count hits, misses and invalidations"""
+        item_cache = ItemCache(LRUCache())
+        item_cache.get(1)
+        item_cache.set(1, "one")
+        item_cache.get(1)
+        item_cache.get(1)
+        item_cache.invalidate(1, 2)
+        item_cache.get(1)
+        stats = item_cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["invalidations"], 2)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+        self.assertEqual(stats["backend"], "LRUCache")
+
+    def test_item_cache_init_app(self):
+        """It should select the backend from the app configuration"""
+        app = Flask(__name__)
+        item_cache = ItemCache()
+        app.config.update(CACHE_BACKEND="memory", CACHE_TTL=3, CACHE_MAX_ITEMS=7)
+        item_cache.init_app(app)
+        self.assertIsInstance(item_cache.backend, LRUCache)
+        self.assertEqual(item_cache.backend.maxsize, 7)
+        app.config["CACHE_BACKEND"] = "none"
+        item_cache.init_app(app)
+        self.assertIsInstance(item_cache.backend, NullCache)
+        app.config["CACHE_BACKEND"] = "disk"
+        self.assertRaises(ValueError, item_cache.init_app, app)
+        # without the redis package the configuration error names it
+        app.config["CACHE_BACKEND"] = "redis"
+        with patch.dict(sys.modules, {"redis": None}):
+            self.assertRaisesRegex(ValueError, "redis package", item_cache.init_app, app)
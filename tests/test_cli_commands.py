@@ -1,23 +1,54 @@
 """
 CLI Command Extensions for Flask
 """
-import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from sqlalchemy.dialects import postgresql
+from flask import Flask
+from service import app
+from service.common.cli_commands import db_create, db_migrate, db_prune_tombstones, init_app
+from service.models import Inventory, InventoryTombstone
 
 
 class TestFlaskCLI(TestCase):
     """Test Flask CLI Commands"""
 
     def setUp(self):
-        self.runner = CliRunner()
+        self.runner = app.test_cli_runner()
+
+    def test_commands_of_the_app(self):
+        """It should add every command to the flask command of the app"""
+        flask_app = Flask(__name__)
+        init_app(flask_app)
+        for name in ("db-create", "db-migrate", "db-prune-tombstones"):
+            self.assertIn(name, flask_app.cli.commands)
 
     @patch('service.common.cli_commands.db')
     def test_db_create(self, db_mock):
         """It should call the db-create command"""
         db_mock.return_value = MagicMock()
-        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
-            result = self.runner.invoke(db_create)
-            self.assertEqual(result.exit_code, 0)
+        result = self.runner.invoke(db_create)
+        self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.db')
+    def test_db_migrate(self, db_mock):
+        """It should create every index with the db-migrate command"""
+        connection = db_mock.engine.connect.return_value.execution_options.return_value
+        connection.dialect = postgresql.dialect()
+        result = self.runner.invoke(db_migrate)
+        self.assertEqual(result.exit_code, 0)
+        db_mock.create_all.assert_called_once()
+        statements = [str(call.args[0]) for call in connection.execute.call_args_list]
+        expected = len(Inventory.__table__.indexes) + len(InventoryTombstone.__table__.indexes)
+        self.assertEqual(len(statements), expected)
+        for statement in statements:
+            self.assertTrue(statement.startswith("CREATE INDEX CONCURRENTLY IF NOT EXISTS"))
+
+    @patch('service.common.cli_commands.InventoryTombstone')
+    def test_db_prune_tombstones(self, tombstone_mock):
+        """It should prune old tombstones with the db-prune-tombstones command"""
+        tombstone_mock.prune.return_value = 3
+        result = self.runner.invoke(db_prune_tombstones, ["--days", "7"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Removed 3 tombstones", result.output)
+        tombstone_mock.prune.assert_called_once()
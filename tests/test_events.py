@@ -0,0 +1,97 @@
+"""
+Test cases for the change event broker
+"""
+from unittest import TestCase
+from service.common.events import Event, EventBroker, TooManySubscribers
+
+
+######################################################################
+#  E V E N T   B R O K E R   T E S T   C A S E S
+######################################################################
+class TestEventBroker(TestCase):
+    """Event Broker Tests"""
+
+    def setUp(self):
+        self.broker = EventBroker(history=3, queue_size=2)
+
+    def _event_id(self, sequence):
+        """Returns the id the broker gives to an event"""
+        return f"{self.broker.epoch}-{sequence}"
+
+    def test_event_to_sse(self):
+        """It should format an event as a Server-Sent Events message"""
+        event = Event("f00d", 7, "update", {"id": 1})
+        self.assertEqual(event.to_sse(), 'id: f00d-7\nevent: update\ndata: {"id": 1}\n\n')
+
+    def test_publish_to_subscribers(self):
+        """It should send published events to every subscriber that wants them"""
+        everything = self.broker.subscribe()
+        restocks = self.broker.subscribe(types=["restock"])
+        self.broker.publish("update", {"id": 1})
+        self.broker.publish("restock", {"id": 2})
+        stream = everything.events(0)
+        self.assertEqual([next(stream).type, next(stream).type], ["update", "restock"])
+        self.assertEqual(restocks.queue.get_nowait(), Event(self.broker.epoch, 2, "restock", {"id": 2}))
+        self.assertTrue(restocks.queue.empty())
+        self.assertEqual(self.broker.stats()["subscribers"], 2)
+        self.assertEqual(self.broker.stats()["published"], 2)
+
+    def test_max_subscribers(self):
+        """It should refuse subscribers beyond the maximum until one leaves"""
+        self.broker.max_subscribers = 1
+        subscription = self.broker.subscribe()
+        self.assertRaises(TooManySubscribers, self.broker.subscribe)
+        self.assertEqual(self.broker.stats()["refused"], 1)
+        self.broker.unsubscribe(subscription)
+        self.broker.subscribe()
+        self.assertEqual(self.broker.stats()["subscribers"], 1)
+
+    def test_keepalive(self):
+        """It should yield None when no event arrives before the keep-alive"""
+        subscription = self.broker.subscribe()
+        self.assertIsNone(next(subscription.events(0.01)))
+
+    def test_drop_slow_subscriber(self):
+        """It should drop a subscriber whose queue is full"""
+        subscription = self.broker.subscribe()
+        for by_id in range(3):
+            self.broker.publish("create", {"id": by_id})
+        self.assertTrue(subscription.dropped)
+        self.assertEqual(self.broker.stats()["dropped"], 1)
+        self.assertEqual(self.broker.stats()["subscribers"], 0)
+        # the queued events are still delivered before the stream ends
+        self.assertEqual([event.id for event in subscription.events(1)], [1, 2])
+
+    def test_replay_after_last_event_id(self):
+        """It should replay the events published after Last-Event-ID"""
+        for by_id in range(4):
+            self.broker.publish("create", {"id": by_id})
+        subscription = self.broker.subscribe(last_event_id=self._event_id(2))
+        self.assertFalse(subscription.missed)
+        self.assertEqual([event.id for event in subscription.replay], [3, 4])
+        self.assertEqual(self.broker.subscribe(last_event_id=self._event_id(4)).replay, [])
+        self.assertEqual(len(self.broker.subscribe(last_event_id=self._event_id(1)).replay), 3)
+
+    def test_missed_events(self):
+        """It should report events that are no longer in the history"""
+        for by_id in range(5):
+            self.broker.publish("create", {"id": by_id})
+        self.assertTrue(self.broker.subscribe(last_event_id=self._event_id(0)).missed)
+        self.assertTrue(self.broker.subscribe(last_event_id=self._event_id(99)).missed)
+        self.broker.clear()
+        self.assertFalse(self.broker.subscribe(last_event_id=self._event_id(5)).missed)
+        self.assertTrue(self.broker.subscribe(last_event_id=self._event_id(4)).missed)
+
+    def test_events_of_another_broker(self):
+        """It should report events published by another broker as missed"""
+        self.broker.publish("create", {"id": 1})
+        other = EventBroker()
+        for last_event_id in [f"{other.epoch}-1", "1", "abc", f"{self.broker.epoch}-x", f"{self.broker.epoch}-²"]:
+            self.assertTrue(self.broker.subscribe(last_event_id=last_event_id).missed)
+
+    def test_unsubscribe(self):
+        """It should stop sending events after unsubscribe"""
+        subscription = self.broker.subscribe()
+        self.broker.unsubscribe(subscription)
+        self.broker.publish("delete", {"id": 1})
+        self.assertTrue(subscription.queue.empty())
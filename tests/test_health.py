@@ -0,0 +1,124 @@
+"""
+Test cases for the readiness probe
+"""
+import time
+import sqlite3
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from service.common.health import HealthProbe
+from service.common.pool import metrics
+
+
+def make_db(connect=lambda: sqlite3.connect(":memory:")):
+    """Returns a stand-in database whose connections come from connect()"""
+    db = MagicMock()
+
+    def raw_connection():
+        connection = MagicMock(wraps=connect())
+        connection.detach = MagicMock()
+        return connection
+    db.engine.raw_connection.side_effect = raw_connection
+    return db
+
+
+######################################################################
+#  R E A D I N E S S   P R O B E   T E S T   C A S E S
+######################################################################
+class TestHealthProbe(TestCase):
+    """Readiness Probe Tests"""
+
+    def setUp(self):
+        metrics.reset()
+        self.app = MagicMock()
+        self.app.config = {"HEALTH_CHECK_INTERVAL": 60, "HEALTH_SATURATED_CHECKS": 2}
+        self.probe = HealthProbe()
+
+    def test_ready(self):
+        """It should be ready when the database answers, and cache the result"""
+        db = make_db()
+        self.probe.init_app(self.app, db)
+        result = self.probe.status()
+        self.assertTrue(result["ready"])
+        self.assertTrue(result["database"]["ok"])
+        self.assertIsNotNone(result["database"]["latency_ms"])
+        self.probe.status()
+        self.assertEqual(db.engine.raw_connection.call_count, 1)
+        self.probe.check()
+        self.assertEqual(db.engine.raw_connection.call_count, 1)
+
+    def test_database_down(self):
+        """It should not be ready when the database cannot be reached"""
+        def fail():
+            raise sqlite3.OperationalError("connection refused")
+        self.probe.init_app(self.app, make_db(fail))
+        result = self.probe.status()
+        self.assertFalse(result["ready"])
+        self.assertEqual(result["reasons"], ["the database cannot be reached"])
+        self.assertIn("connection refused", result["database"]["error"])
+
+    def test_sustained_pool_exhaustion(self):
+        """It should not be ready after the pool stays saturated for several checks"""
+        self.probe.init_app(self.app, make_db())
+        metrics.started()  # a request waiting for a connection
+        self.probe.check()
+        self.assertTrue(self.probe.status()["ready"])
+        self.probe.check()
+        result = self.probe.status()
+        self.assertFalse(result["ready"])
+        self.assertEqual(result["reasons"], ["the connection pool is exhausted"])
+        self.assertEqual(result["pool"]["saturated_checks"], 2)
+        metrics.finished(0.1, "timeouts")
+        self.probe.check()
+        self.assertEqual(self.probe.status()["pool"]["saturated_checks"], 3)
+        self.probe.check()
+        self.assertTrue(self.probe.status()["ready"])
+
+    def test_concurrent_status(self):
+        """It should serve the last result while another request runs the checks"""
+        self.probe.init_app(self.app, make_db(lambda: sqlite3.connect(":memory:", check_same_thread=False)))
+        self.probe.check()
+        self.probe._state["checked_at"] -= 61  # pylint: disable=protected-access
+        pinging, release = threading.Event(), threading.Event()
+        ping = self.probe._ping  # pylint: disable=protected-access
+
+        def slow_ping():
+            pinging.set()
+            release.wait(5)
+            return ping()
+        with patch.object(self.probe, "_ping", side_effect=slow_ping) as ping_mock:
+            checking = threading.Thread(target=self.probe.status)
+            checking.start()
+            self.assertTrue(pinging.wait(5))
+            self.assertTrue(self.probe.status()["ready"])
+            release.set()
+            checking.join(5)
+        self.assertEqual(ping_mock.call_count, 1)
+
+    def test_stale_check(self):
+        """It should not be ready when the background checks stopped"""
+        self.probe.init_app(self.app, make_db())
+        self.probe.check()
+        self.probe._thread = MagicMock()  # pylint: disable=protected-access
+        self.probe.interval = 0.001
+        time.sleep(0.01)
+        result = self.probe.status()
+        self.assertFalse(result["ready"])
+        self.assertEqual(result["reasons"], ["the last check is too old"])
+
+    def test_start_only_when_enabled(self):
+        """It should not start the background checks when the setting disables it"""
+        self.app.config["HEALTH_CHECK_THREAD"] = False
+        self.probe.init_app(self.app, make_db())
+        self.probe.start()
+        self.assertIsNone(self.probe._thread)  # pylint: disable=protected-access
+
+    @patch("service.common.health.threading.Thread")
+    def test_ready_when_started(self, thread_mock):
+        """It should check once when it starts, so the first probe of a worker is answered"""
+        self.probe.init_app(self.app, make_db())
+        self.probe.start()
+        thread_mock.return_value.start.assert_called_once()
+        result = self.probe.status()
+        self.assertTrue(result["ready"])
+        self.assertTrue(result["database"]["ok"])
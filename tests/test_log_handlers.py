@@ -0,0 +1,197 @@
+"""
+Test cases for the log handlers
+"""
+import sys
+import json
+import queue
+import logging
+from unittest import TestCase
+from flask import Flask
+from service.common import log_handlers
+from service.common.log_handlers import (
+    DroppingQueueHandler,
+    JsonFormatter,
+    RequestIdFilter,
+    SamplingFilter,
+    parse_sampling,
+)
+
+
+class ListHandler(logging.Handler):
+    """Keeps the formatted records"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def make_record(message, level=logging.INFO, args=(), exc_info=None):
+    """Returns a record as the flask.app logger would make it"""
+    return logging.getLogger("flask.app").makeRecord(
+        "flask.app", level, __file__, 1, message, args, exc_info
+    )
+
+
+######################################################################
+#  L O G   H A N D L E R S   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Log Handlers Tests"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.gunicorn = logging.getLogger("test.gunicorn")
+        self.gunicorn.setLevel(logging.INFO)
+        self.output = ListHandler()
+        self.gunicorn.handlers = [self.output]
+        module_logger = logging.getLogger("flask.app")
+        self.saved = (list(module_logger.handlers), module_logger.propagate, module_logger.level,
+                      list(module_logger.filters))
+
+        @self.app.route("/items")
+        def items():
+            self.app.logger.info("Listing items")
+            logging.getLogger("flask.app").info("Processing all Inventory items")
+            return {}
+
+    def tearDown(self):
+        log_handlers.stop_queue()
+        module_logger = logging.getLogger("flask.app")
+        (module_logger.handlers, module_logger.propagate, module_logger.level,
+         module_logger.filters) = self.saved
+        self.gunicorn.handlers = []
+
+    def test_json_formatter(self):
+        """It should format a record as a line of JSON"""
+        record = make_record("Creating %s", logging.INFO, ("hammer",))
+        record.request_id = "abc"
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Creating hammer")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], "flask.app")
+        self.assertEqual(entry["request_id"], "abc")
+        self.assertNotIn("exception", entry)
+
+    def test_json_formatter_exception(self):
+        """It should add the traceback of an exception"""
+        exc_info = None
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            exc_info = sys.exc_info()
+        record = make_record("Failed", logging.ERROR, exc_info=exc_info)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertIn("ValueError: bad", entry["exception"])
+
+    def test_request_id_filter(self):
+        """It should add the request id, or - outside a request"""
+        record = make_record("message")
+        RequestIdFilter().filter(record)
+        self.assertEqual(record.request_id, "-")
+        with self.app.test_request_context():
+            log_handlers._assign_request_id()  # pylint: disable=protected-access
+            RequestIdFilter().filter(record)
+            self.assertEqual(len(record.request_id), 32)
+
+    def test_sampling_filter(self):
+        """It should keep one info record in ten of each message and every warning"""
+        sampler = SamplingFilter(0.1)
+        kept = [sampler.filter(make_record("Processing lookup for id %s ...")) for _ in range(30)]
+        self.assertEqual(kept.count(True), 3)
+        self.assertTrue(kept[0])
+        self.assertTrue(sampler.filter(make_record("Creating %s")))
+        warnings = [sampler.filter(make_record("Cannot", logging.WARNING)) for _ in range(5)]
+        self.assertEqual(warnings, [True] * 5)
+        self.assertFalse(SamplingFilter(0).filter(make_record("Creating %s")))
+
+    def test_parse_sampling(self):
+        """It should parse the LOG_SAMPLING setting"""
+        self.assertEqual(parse_sampling(""), {})
+        self.assertEqual(parse_sampling(None), {})
+        self.assertEqual(parse_sampling("flask.app=0.1, service=1"), {"flask.app": 0.1, "service": 1.0})
+        self.assertRaises(ValueError, parse_sampling, "flask.app=2")
+        self.assertRaises(ValueError, parse_sampling, "flask.app")
+
+    def test_dropping_queue_handler(self):
+        """It should drop records when the queue is full"""
+        handler = DroppingQueueHandler(queue.Queue(2))
+        for _ in range(5):
+            handler.handle(make_record("message"))
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+
+    def test_init_logging_json_queue(self):
+        """It should write JSON lines with the request id through the queue"""
+        self.app.config.update(LOG_FORMAT="json", LOG_QUEUE=True, LOG_SAMPLING="flask.app=0.5")
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        self.assertIsInstance(self.app.logger.handlers[0], DroppingQueueHandler)
+        client = self.app.test_client()
+        response = client.get("/items", headers={"X-Request-ID": "req-42"})
+        self.assertEqual(response.headers["X-Request-ID"], "req-42")
+        response = client.get("/items", headers={"X-Request-ID": "not valid!"})
+        generated = response.headers["X-Request-ID"]
+        self.assertEqual(len(generated), 32)
+        log_handlers.stop_queue()
+        entries = [json.loads(line) for line in self.output.lines]
+        messages = [(entry["message"], entry["request_id"]) for entry in entries]
+        self.assertIn(("Listing items", "req-42"), messages)
+        self.assertIn(("Listing items", generated), messages)
+        # one of the two records of the sampled logger is kept
+        modules = [entry for entry in entries if entry["logger"] == "flask.app"]
+        self.assertEqual(len(modules), 1)
+        self.assertEqual(modules[0]["sample_rate"], 0.5)
+
+    def test_init_logging_queued_exception(self):
+        """It should keep the traceback of a queued record apart from its message"""
+        self.app.config.update(LOG_FORMAT="json", LOG_QUEUE=True)
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            self.app.logger.exception("Failed")
+        log_handlers.stop_queue()
+        entry = json.loads(self.output.lines[-1])
+        self.assertEqual(entry["message"], "Failed")
+        self.assertIn("ValueError: bad", entry["exception"])
+
+    def test_init_logging_sampling_once(self):
+        """It should replace the sampling filters each time logging is set up"""
+        self.app.config.update(LOG_QUEUE=False, LOG_SAMPLING="flask.app=0.5")
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        samplers = [item for item in logging.getLogger("flask.app").filters if isinstance(item, SamplingFilter)]
+        self.assertEqual([sampler.rate for sampler in samplers], [0.5])
+        self.app.config["LOG_SAMPLING"] = ""
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        self.assertFalse(any(isinstance(item, SamplingFilter) for item in logging.getLogger("flask.app").filters))
+
+    def test_restart_queue(self):
+        """It should give a forked process a new queue and listener thread"""
+        self.app.config.update(LOG_QUEUE=True)
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        handler = self.app.logger.handlers[0]
+        inherited = handler.queue
+        # a forked process keeps the thread object of its parent, but not the running thread
+        listener = log_handlers._listener  # pylint: disable=protected-access
+        thread = listener._thread  # pylint: disable=protected-access
+        listener.stop()
+        listener._thread = thread  # pylint: disable=protected-access
+        log_handlers.restart_queue()
+        self.assertIsNot(handler.queue, inherited)
+        self.assertIsNot(listener._thread, thread)  # pylint: disable=protected-access
+        self.assertTrue(listener._thread.is_alive())  # pylint: disable=protected-access
+        self.app.test_client().get("/items")
+        log_handlers.stop_queue()
+        self.assertTrue(any(line.endswith("Listing items") for line in self.output.lines))
+
+    def test_init_logging_text(self):
+        """It should keep the text format and write directly without the queue"""
+        self.app.config.update(LOG_QUEUE=False)
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        self.assertEqual(self.app.logger.handlers, [self.output])
+        self.app.test_client().get("/items")
+        self.assertTrue(self.output.lines[0].endswith("Logging handler established"))
+        self.assertIn("[INFO] [test_log_handlers] Listing items", self.output.lines[1])
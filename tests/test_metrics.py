@@ -0,0 +1,91 @@
+"""
+Test cases for the metrics registry
+"""
+import os
+import json
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from service.common.metrics import Registry
+
+
+######################################################################
+#  M E T R I C S   R E G I S T R Y   T E S T   C A S E S
+######################################################################
+class TestRegistry(TestCase):
+    """Metrics Registry Tests"""
+
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.counter("requests_total", "Requests", ("method",))
+        self.registry.gauge("in_flight", "Requests in flight")
+        self.registry.histogram("latency_seconds", "Latency", ("method",), (0.1, 1.0))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_render_counters_and_histograms(self):
+        """It should render counters and cumulative histogram buckets"""
+        self.registry.inc("requests_total", ("GET",))
+        self.registry.inc("requests_total", ("GET",), 2)
+        for value in [0.05, 0.1, 0.5, 3.0]:
+            self.registry.observe("latency_seconds", ("GET",), value)
+        self.registry.function("answer", "gauge", "A constant", lambda: 42)
+        lines = self.registry.render().splitlines()
+        self.assertIn("# TYPE requests_total counter", lines)
+        self.assertIn('requests_total{method="GET"} 3', lines)
+        self.assertIn('latency_seconds_bucket{method="GET",le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{method="GET",le="1.0"} 3', lines)
+        self.assertIn('latency_seconds_bucket{method="GET",le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_sum{method="GET"} 3.65', lines)
+        self.assertIn('latency_seconds_count{method="GET"} 4', lines)
+        self.assertIn(f'answer{{pid="{os.getpid()}"}} 42', lines)
+
+    def test_escape_label_values(self):
+        """It should escape quotes and backslashes in label values"""
+        self.registry.inc("requests_total", ('say "hi"\\',))
+        self.assertIn('requests_total{method="say \\"hi\\"\\\\"} 1', self.registry.render())
+
+    def test_collect_threads(self):
+        """It should add up the values recorded by every thread"""
+        def record():
+            for _ in range(100):
+                self.registry.inc("requests_total", ("GET",))
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.registry.collect()[("requests_total", ("GET",))], 400)
+
+    def test_collect_workers(self):
+        """It should add up the files written by the other workers"""
+        self.registry.directory = self.directory
+        self.registry.inc("requests_total", ("GET",))
+        self.registry.inc("in_flight")
+        self.registry.observe("latency_seconds", ("GET",), 0.5)
+        self.registry.flush(force=True)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"metrics-{os.getpid()}.json")))
+        # a running worker, the parent of this process, and a stopped one
+        rows = [["requests_total", ["GET"], 2], ["in_flight", [], 1],
+                ["latency_seconds", ["GET"], [1, 0, 0, 0.0625]]]
+        for pid in [os.getppid(), 999999999]:
+            with open(os.path.join(self.directory, f"metrics-{pid}.json"), "w", encoding="utf-8") as file:
+                json.dump(rows, file)
+        totals = self.registry.collect_all()
+        self.assertEqual(totals[("requests_total", ("GET",))], 5)
+        self.assertEqual(totals[("in_flight", ())], 2)
+        self.assertEqual(totals[("latency_seconds", ("GET",))], [2, 1, 0, 0.625])
+
+    def test_flush_is_throttled(self):
+        """It should write the metrics file at most once per flush interval"""
+        self.registry.directory = self.directory
+        self.registry.flush_interval = 60
+        self.registry.flush()
+        self.registry.inc("requests_total", ("GET",))
+        self.registry.flush()
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        with open(path, encoding="utf-8") as file:
+            self.assertEqual(json.load(file), [])
@@ -0,0 +1,94 @@
+"""
+Test cases for the outbox relay
+"""
+import json
+from unittest import TestCase
+from unittest.mock import MagicMock
+from service.common.outbox import OutboxRelay, MemoryTransport, NotifyTransport, CHANNEL
+
+
+def make_app(**config):
+    """Returns a stand-in Flask app with some settings"""
+    app = MagicMock()
+    app.config = config
+    return app
+
+
+def make_session(dialect="sqlite"):
+    """Returns a stand-in session bound to a database of some dialect"""
+    session = MagicMock()
+    session.get_bind.return_value.dialect.name = dialect
+    return session
+
+
+######################################################################
+#  O U T B O X   R E L A Y   T E S T   C A S E S
+######################################################################
+class TestOutboxRelay(TestCase):
+    """Outbox Relay Tests"""
+
+    def setUp(self):
+        self.outbox = []
+        self.session = make_session()
+        self.relay = OutboxRelay()
+        self.relay.init_app(make_app(OUTBOX_BATCH_SIZE=2), self.session, self.claim)
+        self.applied = []
+        self.relay.add_handler(lambda event_type, data: self.applied.append((event_type, data)))
+
+    def claim(self, limit):
+        """Removes events from the stand-in outbox"""
+        claimed, self.outbox[:limit] = self.outbox[:limit], []
+        return claimed
+
+    def test_select_transport(self):
+        """It should pick the transport from the setting and the database"""
+        self.assertIsInstance(self.relay.transport, MemoryTransport)
+        relay = OutboxRelay()
+        relay.init_app(make_app(), make_session("postgresql"), self.claim)
+        self.assertIsInstance(relay.transport, NotifyTransport)
+        relay.init_app(make_app(OUTBOX_TRANSPORT="memory"), make_session("postgresql"), self.claim)
+        self.assertIsInstance(relay.transport, MemoryTransport)
+        self.assertRaises(ValueError, relay.init_app, make_app(OUTBOX_TRANSPORT="kafka"),
+                          self.session, self.claim)
+
+    def test_relay_events_of_other_workers(self):
+        """It should apply relayed events written by other workers only"""
+        other = OutboxRelay()
+        self.outbox.extend([
+            self.relay.payload("create", {"id": 1}),
+            other.payload("update", {"id": 2}),
+            other.payload("delete", {"id": 3}),
+        ])
+        self.assertEqual(self.relay.run_once(), 2)
+        self.assertEqual(self.relay.run_once(), 1)
+        self.assertEqual(self.relay.run_once(), 0)
+        self.assertEqual(self.applied, [("update", {"id": 2}), ("delete", {"id": 3})])
+        self.assertEqual(self.session.commit.call_count, 3)
+        stats = self.relay.stats()
+        self.assertEqual((stats["relayed"], stats["received"]), (3, 2))
+        self.assertEqual(stats["transport"], "memory")
+
+    def test_start_only_when_enabled(self):
+        """It should not start the relay thread when the setting disables it"""
+        relay = OutboxRelay()
+        relay.init_app(make_app(OUTBOX_RELAY_THREAD=False), self.session, self.claim)
+        relay.start()
+        self.assertFalse(relay.stats()["running"])
+
+    def test_notify_transport_send(self):
+        """It should send a batch of payloads with one pg_notify statement in the relay transaction"""
+        transport = NotifyTransport(MagicMock())
+        session = MagicMock()
+        transport.send(session, ("a", "b"))
+        session.execute.assert_called_once()
+        statement, params = session.execute.call_args.args
+        self.assertIn("pg_notify", str(statement))
+        self.assertIn("unnest", str(statement))
+        self.assertEqual(params, {"channel": CHANNEL, "payloads": ["a", "b"]})
+        transport.send(session, [])
+        session.execute.assert_called_once()
+
+    def test_payload(self):
+        """It should tag payloads with the origin of the worker"""
+        payload = json.loads(self.relay.payload("restock", {"id": 9}))
+        self.assertEqual(payload, {"origin": self.relay.origin, "type": "restock", "data": {"id": 9}})
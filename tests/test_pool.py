@@ -0,0 +1,60 @@
+"""
+Test cases for the connection pool metrics
+"""
+import sqlite3
+from unittest import TestCase
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from service.common.pool import TimedQueuePool, engine_options, pool_stats, metrics
+
+
+######################################################################
+#  C O N N E C T I O N   P O O L   T E S T   C A S E S
+######################################################################
+class TestConnectionPool(TestCase):
+    """Connection Pool Tests"""
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_count_checkouts_and_timeouts(self):
+        """It should count the checkouts and the waits that time out"""
+        pool = TimedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0,
+                              timeout=0.01)
+        connection = pool.connect()
+        self.assertRaises(PoolTimeoutError, pool.connect)
+        connection.close()
+        pool.connect().close()
+        stats = metrics.stats()
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["waiting"], 0)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0.01)
+
+    def test_count_connection_errors(self):
+        """It should count the checkouts that fail to connect"""
+        def fail():
+            raise sqlite3.OperationalError("unable to open database")
+        pool = TimedQueuePool(fail, pool_size=1)
+        self.assertRaises(sqlite3.OperationalError, pool.connect)
+        self.assertEqual(metrics.stats()["errors"], 1)
+
+    def test_engine_options(self):
+        """It should use the timed pool unless the database is in memory"""
+        options = {"pool_pre_ping": True}
+        self.assertEqual(engine_options("sqlite://", options), options)
+        self.assertEqual(engine_options("sqlite:///:memory:", options), options)
+        self.assertIs(engine_options("sqlite:////tmp/test.db", options)["poolclass"], TimedQueuePool)
+        timed = engine_options("postgresql://localhost/postgres", options)
+        self.assertEqual(timed, {"poolclass": TimedQueuePool, "pool_pre_ping": True})
+
+    def test_pool_stats(self):
+        """It should report the state of the pool with the metrics"""
+        engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=2)
+        with engine.connect():
+            stats = pool_stats(engine)
+        self.assertEqual(stats["class"], "TimedQueuePool")
+        self.assertEqual((stats["size"], stats["checked_out"], stats["overflow"]), (2, 1, 0))
+        self.assertEqual(stats["checkouts"], 1)
+        static = pool_stats(create_engine("sqlite://"))
+        self.assertNotIn("size", static)
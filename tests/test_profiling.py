@@ -0,0 +1,75 @@
+"""
+Test cases for the SQL profiler
+"""
+import logging
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import create_engine, text
+from service.common.profiling import QueryProfiler
+
+
+######################################################################
+#  S Q L   P R O F I L E R   T E S T   C A S E S
+######################################################################
+class TestQueryProfiler(TestCase):
+    """SQL Profiler Tests"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)"))
+            connection.execute(text("INSERT INTO item (name) VALUES ('a'), ('b')"))
+        self.profiler = QueryProfiler()
+        self.app = Flask(__name__)
+
+        @self.app.route("/items")
+        def items():
+            with self.engine.connect() as connection:
+                rows = connection.execute(text("SELECT * FROM item WHERE name = :name"), {"name": "a"})
+                count = len(rows.all())
+                connection.execute(text("SELECT count(*) FROM item")).scalar()
+            return {"count": count}
+
+    def tearDown(self):
+        self.profiler.remove()
+
+    def test_disabled(self):
+        """It should install no hook when profiling is off"""
+        self.profiler.init_app(self.app)
+        response = self.app.test_client().get("/items")
+        self.assertNotIn("Server-Timing", response.headers)
+        self.assertEqual(self.app.before_request_funcs, {})
+
+    def test_server_timing(self):
+        """It should record the statements of a request and add Server-Timing"""
+        self.app.config["SQL_PROFILING"] = True
+        self.profiler.init_app(self.app)
+        with self.assertLogs("flask.app", level=logging.DEBUG) as logs:
+            response = self.app.test_client().get("/items")
+        self.assertEqual(response.get_json(), {"count": 1})
+        self.assertRegex(response.headers["Server-Timing"], r'^db;dur=[\d.]+;desc="2 queries", app;dur=[\d.]+$')
+        self.assertIn("ran 2 SQL statements", logs.output[0])
+        self.assertIn("SELECT count(*) FROM item", logs.output[-1])
+        self.assertEqual(self.profiler.statements(), [])
+
+    def test_slow_query_log(self):
+        """It should log slow statements with their plan after the request"""
+        self.app.config["SLOW_QUERY_MS"] = 0.000001
+        self.profiler.init_app(self.app)
+        with self.assertLogs("flask.app", level=logging.WARNING) as logs:
+            response = self.app.test_client().get("/items")
+        self.assertNotIn("Server-Timing", response.headers)
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn("Slow SQL statement", logs.output[0])
+        self.assertIn("plan:", logs.output[0])
+        self.assertIn("SEARCH item" if "SEARCH" in logs.output[0] else "SCAN item", logs.output[0])
+
+    def test_slow_query_outside_request(self):
+        """It should log slow statements outside requests without a plan"""
+        self.app.config["SLOW_QUERY_MS"] = 0.000001
+        self.profiler.init_app(self.app)
+        with self.assertLogs("flask.app", level=logging.WARNING) as logs:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        self.assertIn("Slow SQL statement", logs.output[0])
+        self.assertNotIn("plan:", logs.output[0])